@@ -12,13 +12,16 @@
 #------------------------------------------------------------
 import os
 import sys
+import mmap
 import shutil
 import re
 import argparse
 import logging
 import traceback
+from bisect import bisect_right
 from datetime import datetime
-from collections import OrderedDict
+from operator import itemgetter
+from functools import lru_cache, wraps
 
 # Extended list of known classes
 dict_known_classes = [
@@ -47,6 +50,12 @@ dict_singleton_classes = {
     # Add other libraries and their keywords here
 }
 
+# Inverted dict_singleton_classes: class (or header) name -> header
+dict_singleton_headers = {header: header for header in dict_singleton_classes}
+dict_singleton_headers.update({class_name: header
+                               for header, classes in dict_singleton_classes.items()
+                               for class_name in classes})
+
 args                      = None
 glob_project_name         = ""
 glob_ino_project_folder   = ""
@@ -55,6 +64,7 @@ glob_pio_folder           = ""
 glob_pio_project_folder   = ""
 glob_pio_src              = ""
 glob_pio_include          = ""
+glob_pio_arduinoGlue      = ""
 dict_all_includes         = {}
 dict_global_variables     = {}
 dict_undefined_vars_used  = {}
@@ -62,7 +72,12 @@ dict_prototypes           = {}
 dict_class_instances      = {}
 dict_struct_declarations  = {}
 dict_includes             = {}
+dict_file_contents        = {}
+dict_source_functions     = {}
+deferred_write_paths      = None
+io_buffer_size            = 1 << 20
 platformio_marker         = "/PlatformIO"
+marker_prefix             = "//============ "
 all_includes_marker       = "//============ Includes ===================="
 all_includes_added        = False
 all_defines_marker        = "//============ Defines & Macros===================="
@@ -80,6 +95,173 @@ prototypes_added         = False
 convertor_marker          = "//============ Added by Convertor =========="
 convertor_added          = False
 
+# Precompiled regular expressions
+convertor_marker_line_re  = re.compile(rf'^[ \t]*{re.escape(convertor_marker)}[ \t\r]*$', re.MULTILINE)
+comment_end_line_re       = re.compile(r'(?://|\*/)[ \t\r]*$', re.MULTILINE)
+header_guard_define_re    = re.compile(r'#define\s+\w+_H\s*\n')
+include_line_re           = re.compile(r'^[ \t]*#include', re.MULTILINE)
+first_code_line_re        = re.compile(r'^[ \t\r\f\v]*[^#\s]', re.MULTILINE)
+brace_re                  = re.compile(rb'[{}]')
+comment_span_re           = re.compile(rb'//[^\n]*|/\*.*?(?:\*/|\Z)', re.DOTALL)
+declaration_re            = re.compile(rb'\b(typedef\s+)?(struct|union|enum)\s+(?:\w+\s+)*(?:\w+\s*)?{')
+header_guard_re           = re.compile(r'#ifndef\s+(\w+_H).*?#define\s+\1', re.DOTALL)
+comment_re                = re.compile(r'/\*[\s\S]*?\*/|//[^\n]*')
+comment_and_literal_re    = re.compile(r'//[^\n]*|/\*.*?\*/|\'(?:\\.|[^\\\'])*\'|"(?:\\.|[^\\"])*"', re.DOTALL)
+include_name_re           = re.compile(r'#include\s*[<"]([^>"]+)[>"]')
+angle_include_line_re     = re.compile(r'^[^\S\n]*(#include <[^>\n]+>)[^\n]*\n?', re.MULTILINE)
+
+# extract_global_variables(): any type, including custom types and structs
+var_type_pattern          = r'(?:\w+(?:::\w+)*(?:\s*<[^>]+>)?(?:\s*\*)*)'
+global_var_re             = re.compile(rf'^\s*((?:static|volatile|const)?\s*{var_type_pattern})\s+((?:[a-zA-Z_]\w*(?:\[.*?\])?(?:\s*=\s*[^,;]+)?\s*,\s*)*[a-zA-Z_]\w*(?:\[.*?\])?(?:\s*=\s*[^,;]+)?)\s*;')
+global_class_instance_re  = re.compile(rf'^\s*((?:static)?\s*{var_type_pattern})\s+([a-zA-Z_]\w*)(?:\s*\(.*?\))?\s*;')
+global_func_re            = re.compile(rf'^\s*(?:static|volatile|const)?\s*{var_type_pattern}\s+([a-zA-Z_]\w*)\s*\((.*?)\)')
+global_struct_re          = re.compile(r'^\s*struct\s+([a-zA-Z_]\w*)\s*{')
+quote_or_escape_re        = re.compile(r'\\[\s\S]|["\']')
+var_declarator_re         = re.compile(r'([a-zA-Z_]\w*(?:\[.*?\])?)(?:\s*=\s*[^,;]+)?')
+
+# extract_constant_pointers(): const char* / const int* arrays (String and the basic types)
+basic_types_pattern       = r'uint8_t|int8_t|uint16_t|int16_t|uint32_t|int32_t|uint64_t|int64_t|char|int|float|double|bool|boolean|long|short|unsigned|signed|size_t|void|String|time_t|struct tm'
+# (only at the start of a declaration, i.e. at the start of the content or after a ';')
+constant_pointer_re       = re.compile(rf'(?:\A|;)\s*const\s+({basic_types_pattern})\s*\*\s*(\w+)\s*\[\]\s*{{' + r'\s*(?:"[^";]*"\s*,\s*)*"[^";]*"\s*}')
+
+# extract_undefined_vars_in_file()
+var_declaration_re        = re.compile(r'\b(?:const\s+)?(?:unsigned\s+)?(?:static\s+)?(?:volatile\s+)?\w+\s+([a-zA-Z_]\w*)(?:\s*=|\s*;|\s*\[)')
+identifier_re             = re.compile(r'\b([a-zA-Z_]\w*)\b')
+newline_re                = re.compile(r'\n')
+
+# extract_prototypes(): function header
+prototype_re              = re.compile(r'^\s*(?:static\s+|inline\s+|virtual\s+|explicit\s+|constexpr\s+)*'
+                                       r'(?:const\s+)?'
+                                       r'(?:\w+(?:::\w+)*\s+)+'
+                                       r'[\*&]?\s*'
+                                       r'(\w+)\s*\(((?:[^()]|\([^()]*\))*)\)\s*{', re.MULTILINE)
+whitespace_re             = re.compile(r'\s+')
+control_keywords          = frozenset({'if', 'else', 'for', 'while', 'switch', 'case'})
+
+define_re                 = re.compile(rb'''
+    ^[^\S\n]*\#define[^\S\n]+(\w+)[^\n]*         # the #define line itself
+    (?:(?<=\\)                                    # ending in a backslash:
+        (?:\n(?=[^\n]*\\[^\S\n]*$)[^\n]*)*        #   continuation lines ending in a backslash
+        (?:\n[^\n]*)?                             #   and the last continuation line
+    )?
+    (?:(?<!\\)\n(?=[^\S\n]*\))[^\n]*)?            # a line closing a parenthesis
+    ''', re.MULTILINE | re.VERBOSE)
+header_guard_block_re     = re.compile(r'#ifndef\s+\w+\s+#define\s+\w+')
+header_guard_block_bytes_re = re.compile(rb'#ifndef\s+\w+\s+#define\s+\w+')
+
+# remove_unused_markers_from_arduinoGlue(): from a marker up to the next marker or #endif
+arduinoGlue_markers       = (all_includes_marker, struct_union_and_enum_marker, extern_variables_marker,
+                             global_pointer_arrays_marker, extern_classes_marker, prototypes_marker, convertor_marker)
+all_markers_pattern       = '|'.join(re.escape(marker) for marker in arduinoGlue_markers)
+marker_section_re         = re.compile(rf'({all_markers_pattern}).*?(?={all_markers_pattern}|#endif)', re.DOTALL)
+
+# insert_class_instances_to_header_files(): the libraries of all '#include <..>' lines (optionally followed by a comment)
+library_include_name_re   = re.compile(r'#include[ \t]*<([^<>]*)>(?=[ \t\r]*(?://.*)?$)', re.MULTILINE)
+
+# update_header_with_prototypes(), find_undefined_functions_and_update_headers() and process_function_references()
+angle_include_re          = re.compile(r'#include\s*<[^>]+>')
+existing_prototype_re     = re.compile(r'^[^\S\r\n]*(?:extern\s+)?\w[\w\s\*\(\),]*\s*\([^;]*\);', re.MULTILINE)
+function_call_re          = re.compile(r'\b(\w+)\s*\(')
+local_function_re         = re.compile(r'\b\w+[\s\*]+(\w+)\s*\([^)]*\)\s*{')
+header_prototype_re       = re.compile(r'^\w+[\s\*]+(\w+)\s*\([^)]*\);', re.MULTILINE)
+
+# add_guards_and_marker_to_header(): runs of empty lines, a header guard on the first two lines and #include lines
+empty_lines_re            = re.compile(r'\n\s*\n')
+guard_lines_re            = re.compile(r'[^\S\n]*#ifndef[^\n]*\n[^\S\n]*#define')
+include_directive_line_re = re.compile(r'^[^\S\n]*#include', re.MULTILINE)
+
+# update_project_header(): the '//==..==' marker sections and the '#include "x.h"' lines
+section_marker_re         = re.compile(r'(//==.*?==)', re.DOTALL)
+quoted_include_line_re    = re.compile(r'#include "([^"\n]*)"\n')
+
+# Default platformio.ini (written by create_platformio_ini())
+platformio_ini_content = """
+; PlatformIO Project Configuration File
+;
+;   Build options: build flags, source filter
+;   Upload options: custom upload port, speed and extra flags
+;   Library options: dependencies, extra library storages
+;   Advanced options: extra scripting
+;
+; Please visit documentation for the other options and examples
+; https://docs.platformio.org/page/projectconf.html
+
+[platformio]
+workspace_dir = .pio.nosync
+default_envs = myBoard
+
+[env:myBoard]
+;-- esp32
+#platform = espressif32
+#board = esp32dev
+#framework = arduino
+#board_build.partitions = <min_spiffs.csv>
+#board_build.filesystem = <LittleFS>|<SPIFFS>
+#monitor_speed = 115200
+#upload_speed = 115200
+#build_flags =
+#\t-D DEBUG
+#
+#lib_ldf_mode = deep+
+#
+#lib_deps =
+;\t<select libraries with "PIO Home" -> Libraries
+
+##-- you NEED the next line (with the correct port)
+##-- or the data upload will NOT work!
+#upload_port = </dev/serial_port>
+#monitor_filters =
+#  esp32_exception_decoder
+
+;-- esp8266
+#platform = espressif8266
+#board = esp12e
+#framework = arduino
+##-- you NEED the next line (with the correct port)
+##-- or the data upload will NOT work!
+#upload_port = </dev/serial_port>
+#board_build.filesystem = <littlefs>|<spiffs>
+#build_flags =
+#\t-D DEBUG
+#
+#lib_ldf_mode = deep+
+#
+#lib_deps =
+;\t<select libraries with "PIO Home" -> Libraries
+#monitor_filters =
+#  esp8266_exception_decoder
+
+;-- attiny85
+#platform = atmelavr
+#board = attiny85
+#framework = arduino
+#upload_protocol = usbtiny
+#upload_speed = 19200
+;-- Clock source Int.RC Osc. 8MHz PWRDWN/RESET: 6 CK/1
+#board_fuses.lfuse = 0xE2
+;-- Serial program downloading (SPI) enabled
+;-- brown-out Detection 1.8v (0xDE)
+;board_fuses.hfuse = 0xDE    
+;-- brown-out detection 2.7v (0xDD)
+#board_fuses.hfuse = 0xDD    
+;-- brown-out detection 4.3v (0xDC)
+;board_fuses.hfuse = 0xDC    
+#board_fuses.efuse = 0xFF
+
+#framework = arduino
+#board_build.filesystem = LittleFS
+#monitor_speed = 115200
+#upload_speed = 115200
+#upload_port = <select port like "/dev/cu.usbserial-3224144">
+#build_flags =
+#\t-D DEBUG
+#
+#lib_ldf_mode = deep+
+#
+#lib_deps =
+;\t<select libraries with "PIO Home" -> Libraries
+"""
+
 #------------------------------------------------------------------------------------------------------
 def setup_logging(debug=False):
     level = logging.DEBUG if debug else logging.INFO
@@ -88,6 +270,20 @@ def setup_logging(debug=False):
         format='%(levelname)7s - :%(lineno)4d - %(message)s'
     )
 
+#------------------------------------------------------------------------------------------------------
+def log_and_exit(func):
+    """Decorator: log any exception raised by func (with its line number) and exit."""
+    @wraps(func)
+    def wrapper(*func_args, **func_kwargs):
+        try:
+            return func(*func_args, **func_kwargs)
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            line_number = exc_tb.tb_next.tb_lineno if exc_tb.tb_next else exc_tb.tb_lineno
+            logging.error(f"\tAn error occurred in {func.__name__}() at line {line_number}: {str(e)}")
+            exit()
+    return wrapper
+
 #------------------------------------------------------------------------------------------------------
 def parse_arguments():
     """Parse command-line arguments."""
@@ -102,17 +298,18 @@ def backup_project():
     """Create a backup of the project folder."""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     backup_folder = f"{glob_ino_project_folder}_backup_{timestamp}"
-    shutil.copytree(glob_ino_project_folder, backup_folder)
+    # Content copy is enough for a backup (no need to replay the metadata)
+    shutil.copytree(glob_ino_project_folder, backup_folder, copy_function=shutil.copy, dirs_exist_ok=True)
     logging.info(f"Project backup created at: {backup_folder}")
 
 #------------------------------------------------------------------------------------------------------
-def print_dict(dict):
-      keys = list(dict.keys())
-      logging.info(f"Keys: {keys}")
-      # Iterate over keys and values
-      logging.info("Iterating over keys and values:")
-      for key, value in dict_global_variables.items():
-          logging.info(f"  key[{key}]: value[{value}]")
+@log_and_exit
+def print_dict(d):
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return
+    # Log all keys and values in one go
+    logging.info("Keys: %s\nIterating over keys and values:\n%s",
+                 list(d), "\n".join(f"  key[{key}]: value[{value}]" for key, value in d.items()))
 
 #------------------------------------------------------------------------------------------------------
 def set_glob_project_info(project_dir):
@@ -132,25 +329,32 @@ def set_glob_project_info(project_dir):
     global glob_pio_folder
     global glob_pio_src
     global glob_pio_include
+    global glob_pio_arduinoGlue
 
     # Use project_dir if provided, otherwise use the current working directory
     glob_ino_project_folder = os.path.abspath(project_dir) if project_dir else os.path.abspath(glob_working_dir)
     glob_project_name       = os.path.basename(glob_ino_project_folder)
     glob_pio_folder         = os.path.join(glob_ino_project_folder, "PlatformIO")
     glob_pio_project_folder = os.path.join(glob_pio_folder, glob_project_name)
-    glob_pio_src            = os.path.join(glob_pio_folder, glob_project_name, "src")
-    glob_pio_include        = os.path.join(glob_pio_folder, glob_project_name, "include")
+    glob_pio_src            = os.path.join(glob_pio_project_folder, "src")
+    glob_pio_include        = os.path.join(glob_pio_project_folder, "include")
+    glob_pio_arduinoGlue    = os.path.join(glob_pio_include, "arduinoGlue.h")
+
+    # short_path() results depend on glob_project_name
+    short_path.cache_clear()
 
     logging.debug(f"glob_ino_project_folder: {glob_ino_project_folder}")
     logging.debug(f"glob_pio_project_folder: {glob_pio_project_folder}")
     logging.debug(f"      glob_project_name: {glob_project_name}")
     logging.debug(f"        glob_pio_folder: {glob_pio_folder}")
     logging.debug(f"           glob_pio_src: {glob_pio_src}")
-    logging.debug(f"       glob_pio_include: {glob_pio_include}\n")
+    logging.debug(f"       glob_pio_include: {glob_pio_include}")
+    logging.debug(f"   glob_pio_arduinoGlue: {glob_pio_arduinoGlue}\n")
 
     return
 
 #------------------------------------------------------------------------------------------------------
+@lru_cache(maxsize=4096)
 def extract_word_by_position(s, word_number, separator):
     """
     Extracts the word at the specified position based on the given separator.
@@ -163,14 +367,12 @@ def extract_word_by_position(s, word_number, separator):
     Returns:
     str: The extracted word or None if the position is out of range.
     """
-    # Split the string based on the separator
-    parts = s.split(separator)
-    
+    # Only split as far as needed to reach the requested word
     if separator == '(':
-        # Further split the part before the first '(' by whitespace to get individual words
-        words = parts[0].strip().split()
+        # Split the part before the first '(' by whitespace to get individual words
+        words = s.partition('(')[0].split(None, word_number + 1)
     else:
-        words = parts
+        words = s.split(separator, word_number + 1)
     
     # Return the word at the specified position if within range
     if 0 <= word_number < len(words):
@@ -179,6 +381,7 @@ def extract_word_by_position(s, word_number, separator):
     return None
 
 #------------------------------------------------------------------------------------------------------
+@lru_cache(maxsize=4096)
 def short_path(directory_path):
     """
     Format the directory path for logging, shortening it if it contains the {marker}.
@@ -197,25 +400,42 @@ def short_path(directory_path):
     else:
         return f"{directory_path}"
 
+#------------------------------------------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def library_include_re(library_name):
+    """
+    Return the (compiled and cached) regex matching an '#include <library_name>' line,
+    optionally followed by a comment.
+    """
+    return re.compile(rf'#include[ \t]*<{re.escape(library_name)}>[ \t\r]*(//.*)?$', re.MULTILINE)
+
 #------------------------------------------------------------------------------------------------------
 def create_arduinoglue_file():
     """
     Create arduinoGlue.h file with necessary markers and header guards.
     """
     try:
-        all_defines_path = os.path.join(glob_pio_include, 'arduinoGlue.h')
+        all_defines_path = glob_pio_arduinoGlue
         logging.info(f"\tCreating arduinoGlue.h")
+        glue_lines = [
+            "#ifndef ARDUINOGLUE_H",
+            "#define ARDUINOGLUE_H",
+            "",
+            "",
+            all_includes_marker,
+            all_defines_marker,
+            "",
+            struct_union_and_enum_marker,
+            extern_variables_marker,
+            global_pointer_arrays_marker,
+            extern_classes_marker,
+            prototypes_marker,
+            convertor_marker,
+            "#endif // ARDUINOGLUE_H",
+            ""
+        ]
         with open(all_defines_path, 'w') as f:
-            f.write("#ifndef ARDUINOGLUE_H\n#define ARDUINOGLUE_H\n\n")
-            f.write(f"\n{all_includes_marker}")
-            f.write(f"\n{all_defines_marker}")
-            f.write(f"\n\n{struct_union_and_enum_marker}")
-            f.write(f"\n{extern_variables_marker}")
-            f.write(f"\n{global_pointer_arrays_marker}")
-            f.write(f"\n{extern_classes_marker}")
-            f.write(f"\n{prototypes_marker}")
-            f.write(f"\n{convertor_marker}")
-            f.write("\n#endif // ARDUINOGLUE_H\n")
+            f.write('\n'.join(glue_lines))
 
         logging.info(f"\tSuccessfully created {short_path(all_defines_path)}")
 
@@ -234,33 +454,16 @@ def find_marker_position(content, prio_marker):
             logging.error(f"find_marker_position(): content is empty")
             return -1
         
-        marker = prio_marker
-        marker_index = content.find(marker)
-        if marker_index != -1:
-            return marker_index + len(marker +'\n')
-        
-        marker = all_includes_marker
-        marker_index = content.find(marker)
-        if marker_index != -1:
-            return marker_index + len(marker +'\n')
-        
-        marker = extern_variables_marker
-        marker_index = content.find(marker)
-        if marker_index != -1:
-            return marker_index + len(marker +'\n')
-        
-        marker = prototypes_marker
-        marker_index = content.find(marker)
-        if marker_index != -1:
-            return marker_index + len(marker +'\n')
-        
-        marker = convertor_marker
-        marker_index = content.find(marker)
-        if marker_index != -1:
-            return marker_index + len(marker +'\n')
-
-        marker = ""
-        header_guard_end = re.search(r'#define\s+\w+_H\s*\n', content)
+        # All markers start with marker_prefix, so a file without it has none of them
+        # and a marker can't be found before the first marker_prefix
+        first_marker = content.find(marker_prefix)
+        if first_marker != -1:
+            for marker in (prio_marker, all_includes_marker, extern_variables_marker, prototypes_marker, convertor_marker):
+                marker_index = content.find(marker, first_marker)
+                if marker_index != -1:
+                    return marker_index + len(marker +'\n')
+
+        header_guard_end = header_guard_define_re.search(content)
         if header_guard_end:
             return header_guard_end.end()
 
@@ -286,8 +489,42 @@ def remove_comments(code):
     # Remove multi-line comments
     code = re.sub(r'/\*[\s\S]*?\*/', '', code)
     return code
+
+#------------------------------------------------------------------------------------------------------
+def strip_comments(content):
+    """
+    Remove the '//' comments (including their newline) and the '/* */' comments from content.
+    Jumps from '/' to '/' with str.find(), so it runs in linear time without any backtracking.
+    A '//' comment without a newline or an unclosed '/*' comment is left as it is.
+    """
+    parts = []
+    cursor = 0
+    pos = content.find('/')
+    while pos != -1:
+        next_char = content[pos + 1:pos + 2]
+        if next_char == '/':
+            end = content.find('\n', pos + 2)
+            end = end + 1 if end != -1 else -1
+        elif next_char == '*':
+            end = content.find('*/', pos + 2)
+            end = end + 2 if end != -1 else -1
+        else:
+            end = -1
+
+        if end == -1:
+            pos = content.find('/', pos + 1)
+        else:
+            parts.append(content[cursor:pos])
+            cursor = end
+            pos = content.find('/', end)
+
+    if not parts:
+        return content
+    parts.append(content[cursor:])
+    return ''.join(parts)
    
 #------------------------------------------------------------------------------------------------------
+@log_and_exit
 def print_global_vars(global_vars):
     """
     Print global variables line by line, grouped by file.
@@ -296,28 +533,25 @@ def print_global_vars(global_vars):
     global_vars (dict): Dictionary of global variables, where keys are file paths
                         and values are lists of tuples (var_type, var_name, function, is_pointer)
     """
-    if not any(vars_list for vars_list in global_vars.values()):
+    if not logging.getLogger().isEnabledFor(logging.INFO):
         return
-    try:
-        sorted_global_vars = sort_global_vars(global_vars)
-
-        if (len(sorted_global_vars) > 0):
-            logging.info("")
-            logging.info("--- Global Variables ---")
-        for file_path, vars_list in sorted_global_vars.items():
-            if vars_list:  # Only print for files that have global variables
-                for var_type, var_name, function, is_pointer in vars_list:
-                    pointer_str = "*" if is_pointer else " "
-                    function_str = function if function else "global scope"
-                    logging.info(f"       {var_type:<15} {var_name:<35} {function_str:<20} (in {file_path})")
-        
-        logging.info("")
-
-    except Exception as e:
-        exc_type, exc_obj, exc_tb = sys.exc_info()
-        line_number = exc_tb.tb_lineno
-        logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
-        exit()
+    if not any(global_vars.values()):
+        return
+    sorted_global_vars = sort_global_vars(global_vars)
+
+    buf = []
+    if (len(sorted_global_vars) > 0):
+        buf.append("")
+        buf.append("--- Global Variables ---")
+    for file_path, vars_list in sorted_global_vars.items():
+        if vars_list:  # Only print for files that have global variables
+            for var_type, var_name, function, is_pointer in vars_list:
+                pointer_str = "*" if is_pointer else " "
+                function_str = function if function else "global scope"
+                buf.append("       %-15s %-35s %-20s (in %s)" % (var_type, var_name, function_str, file_path))
+    buf.append("")
+
+    logging.info("%s", "\n".join(buf))
 
 #------------------------------------------------------------------------------------------------------
 def sort_global_vars(global_vars):
@@ -329,15 +563,14 @@ def sort_global_vars(global_vars):
                         and values are lists of tuples (var_type, var_name, function, is_pointer)
 
     Returns:
-    OrderedDict: Sorted dictionary of global variables
+    dict: Sorted dictionary of global variables
     """
-    sorted_dict = OrderedDict()
-    for file_path in sorted(global_vars.keys()):
-        sorted_dict[file_path] = sorted(global_vars[file_path], key=lambda x: x[1])  # Sort by var_name
-    return sorted_dict
+    # Sort by file path, then by var_name
+    return {file_path: sorted(global_vars[file_path], key=itemgetter(1)) for file_path in sorted(global_vars)}
 
 
 #------------------------------------------------------------------------------------------------------
+@log_and_exit
 def print_global_vars_undefined(global_vars_undefined):
     """
     Print global variables used in functions.
@@ -345,24 +578,25 @@ def print_global_vars_undefined(global_vars_undefined):
     Args:
     global_vars_undefined (dict): Dictionary of global variables used in functions
     """
-    try:
-        if (len(global_vars_undefined) > 0):
-            logging.info("")
-            logging.info("--- Undefined Global Variables ---")
-        for key, info in sorted(global_vars_undefined.items(), key=lambda x: (x[1]['var_name'], x[1]['used_in'], x[1]['line'])):
-            pointer_str = "*" if info['var_is_pointer'] else ""
-            var_type_pointer = f"{info['var_type']}{pointer_str}"
-            logging.info(f"  - {var_type_pointer:<15.15} {info['var_name']:<30} (line {info['line']:<4}  in {info['used_in'][:20]:<20}) [{var_type_pointer:<25.25}] (defined in {info['defined_in']})")
-
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return
+    if (len(global_vars_undefined) > 0):
         logging.info("")
+        logging.info("--- Undefined Global Variables ---")
+    # Build the sort key once per entry: (var_name, used_in, line, info)
+    keyed_vars = [(info['var_name'], info['used_in'], info['line'], info) for info in global_vars_undefined.values()]
+    keyed_vars.sort(key=itemgetter(0, 1, 2))
+    for _, _, _, info in keyed_vars:
+        # Build the type string once, it is used for both columns
+        var_type_pointer = info['var_type'] + ("*" if info['var_is_pointer'] else "")
+        logging.info("  - %-15.15s %-30s (line %-4d  in %-20.20s) [%-25.25s] (defined in %s)",
+                     var_type_pointer, info['var_name'], info['line'], info['used_in'],
+                     var_type_pointer, info['defined_in'])
 
-    except Exception as e:
-        exc_type, exc_obj, exc_tb = sys.exc_info()
-        line_number = exc_tb.tb_lineno
-        logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
-        exit()
+    logging.info("")
 
 #------------------------------------------------------------------------------------------------------
+@log_and_exit
 def print_prototypes(functions_dict):
     """
     Print the function prototypes and their source files.
@@ -370,51 +604,43 @@ def print_prototypes(functions_dict):
     Args:
     functions_dict (dict): Dictionary of function prototypes, with function names as keys and tuples (prototype, file_path) as values.
     """
-    try:
-      if not functions_dict:
-          logging.info("\tNo functions found.")
-          return
-
-      logging.info("")
-      logging.info("--- Function Prototypes ---")
-      for key, value in functions_dict.items():
-          func_name, params = key
-          prototype, file_name, bare_func_name = value
-          logging.info(f"{file_name:<25}  {bare_func_name:<30} {prototype}")
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return
+    if not functions_dict:
+        logging.info("\tNo functions found.")
+        return
 
-      logging.info("")
+    buf = ["", "--- Function Prototypes ---"]
+    for key, value in functions_dict.items():
+        func_name, params = key
+        prototype, file_name, bare_func_name = value
+        buf.append("%-25s  %-30s %s" % (file_name, bare_func_name, prototype))
+    buf.append("")
 
-    except Exception as e:
-        exc_type, exc_obj, exc_tb = sys.exc_info()
-        line_number = exc_tb.tb_lineno
-        logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
-        exit()
+    logging.info("%s", "\n".join(buf))
 
 
 #------------------------------------------------------------------------------------------------------
+@log_and_exit
 def print_class_instances(class_instances):
     """Print the dictionary of class instances."""
-    try:
-        if not any(vars_list for vars_list in class_instances.values()):
-            return
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return
+    if not any(class_instances.values()):
+        return
 
-        logging.info("")
-        logging.info("--- Class Instances ---")
-        for file_path, class_list in class_instances.items():
-            if class_list:  # Only print for files that have classes
-                for class_type, instance_name, constructor_args, fbase in class_list:
-                    parentacedConstructor = "("+constructor_args+")"
-                    logging.info(f"       {class_type:<25} {instance_name:<25} {parentacedConstructor:<15} (in {fbase})")
-        
-        logging.info("")
-                                    
-    except Exception as e:
-        exc_type, exc_obj, exc_tb = sys.exc_info()
-        line_number = exc_tb.tb_lineno
-        logging.error(f"A\tn error occurred at line {line_number}: {str(e)}")
-        exit()
+    buf = ["", "--- Class Instances ---"]
+    for file_path, class_list in class_instances.items():
+        if class_list:  # Only print for files that have classes
+            for class_type, instance_name, constructor_args, fbase in class_list:
+                parentacedConstructor = "("+constructor_args+")"
+                buf.append("       %-25s %-25s %-15s (in %s)" % (class_type, instance_name, parentacedConstructor, fbase))
+    buf.append("")
+
+    logging.info("%s", "\n".join(buf))
 
 #------------------------------------------------------------------------------------------------------
+@log_and_exit
 def print_includes(includes):
     """
     Prints the list of include statements.
@@ -422,34 +648,32 @@ def print_includes(includes):
     Args:
     includes (list): List of include statements to print.
     """
-    try:
-        if len(includes) == 0:
-            return
-
-        logging.info("")
-        logging.info("--- Include Statements ---")
-        for include in includes:
-            logging.info(f"  {include}")
-        logging.info("")
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return
+    if len(includes) == 0:
+        return
 
-    except Exception as e:
-        exc_type, exc_obj, exc_tb = sys.exc_info()
-        line_number = exc_tb.tb_lineno
-        logging.error(f"A\tn error occurred at line {line_number}: {str(e)}")
-        exit()
+    logging.info("")
+    logging.info("--- Include Statements ---")
+    for include in includes:
+        logging.info("  %s", include)
+    logging.info("")
 
 
 
 #------------------------------------------------------------------------------------------------------
+@log_and_exit
 def print_struct_definitions(struct_definitions):
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return
     if struct_definitions:
-        logging.info(f"\tStruct definitions found:")
+        logging.info("\tStruct definitions found:")
         for struct_name, struct_body in struct_definitions.items():
-            logging.info(f"\t\t{struct_name}:")
+            logging.info("\t\t%s:", struct_name)
             for line in struct_body.split('\n'):
-                logging.info(f"\t\t\t{line.strip()}")
+                logging.info("\t\t\t%s", line.strip())
     else:
-        logging.info(f"\tNo struct definitions found in the file")
+        logging.info("\tNo struct definitions found in the file")
 
 #------------------------------------------------------------------------------------------------------
 def list_files_in_directory(directory_path):
@@ -458,13 +682,15 @@ def list_files_in_directory(directory_path):
     
     Args:
     directory_path (str): The path to the directory to list files from.
+
+    Returns:
+    list: The names of the files in the directory (so callers don't have to scan it again).
     """
+    files = []
     try:
-        # Get the list of all entries in the directory
-        entries = os.listdir(directory_path)
-        
-        # Filter out directories, keep only files
-        files = [entry for entry in entries if os.path.isfile(os.path.join(directory_path, entry))]
+        # Get the list of all files in the directory (scandir caches the file type)
+        with os.scandir(directory_path) as entries:
+            files = [entry.name for entry in entries if entry.is_file()]
         
         #marker_index = directory_path.find(platformio_marker)
         #if marker_index != -1:
@@ -492,6 +718,87 @@ def list_files_in_directory(directory_path):
           logging.error(f"\tAn error occurred in {fname} at line {line_number}: {str(e)}")
           exit()
 
+    return files
+
+#------------------------------------------------------------------------------------------------------
+def walk_files(folder, extensions):
+    """
+    Yield the paths of all files in folder (and its subfolders) that end in one of the extensions.
+    Same order as os.walk(), but the DirEntry objects from os.scandir() already know their type.
+    """
+    subfolders = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # Like os.walk(), don't follow symlinked folders
+                    if not entry.is_symlink():
+                        subfolders.append(entry.path)
+                elif entry.name.endswith(extensions):
+                    yield entry.path
+    except OSError:
+        return
+
+    for subfolder in subfolders:
+        yield from walk_files(subfolder, extensions)
+
+#------------------------------------------------------------------------------------------------------
+def read_file_contents(file_path):
+    """
+    Return the contents of file_path (read in text mode).
+    The file is only read from disk once; later calls get the cached contents.
+    """
+    content = dict_file_contents.get(file_path)
+    if content is None:
+        with open(file_path, 'r') as file:
+            content = file.read()
+        dict_file_contents[file_path] = content
+    return content
+
+#------------------------------------------------------------------------------------------------------
+def write_file(file_path, content):
+    """
+    Write content (a string, or a list of strings that don't have to be joined first)
+    to file_path through a large buffer.
+    The content goes to a temporary file first that then replaces file_path,
+    so file_path is never left half written (and keeps its permission bits).
+    """
+    temp_path = file_path + '.tmp'
+    try:
+        with open(temp_path, 'w', buffering=io_buffer_size) as file:
+            if isinstance(content, str):
+                file.write(content)
+            else:
+                file.writelines(content)
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        # Don't leave the temporary file behind in src/ or include/
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+#------------------------------------------------------------------------------------------------------
+def write_file_contents(file_path, content):
+    """
+    Write content to file_path and keep the cached contents up to date.
+    While the writes are deferred (deferred_write_paths is a set), only the cached contents
+    are updated; flush_deferred_writes() writes them.
+    """
+    dict_file_contents[file_path] = content
+    if deferred_write_paths is not None:
+        deferred_write_paths.add(file_path)
+    else:
+        write_file(file_path, content)
+
+#------------------------------------------------------------------------------------------------------
+def flush_deferred_writes():
+    """Write the cached contents of all files changed since the last flush."""
+    for file_path in deferred_write_paths:
+        write_file(file_path, dict_file_contents[file_path])
+    deferred_write_paths.clear()
+
 #------------------------------------------------------------------------------------------------------
 def rename_file(old_name, new_name):
     logging.info("")
@@ -533,48 +840,29 @@ def remove_pio_tree(preserve_file):
     preserve_file_path = os.path.join(glob_pio_project_folder, preserve_file)
     #logging.info(f"\t>>>> Preserve [{short_path(preserve_file_path)}]")
     
-    # Check if the preserve_file exists and read its contents
-    preserve_file_contents = None
-    if os.path.exists(preserve_file_path):
-        with open(preserve_file_path, 'r') as f:
-            preserve_file_contents = f.read()
-    
     try:
-        # Remove all contents of the last folder
-        for root, dirs, files in os.walk(glob_pio_folder, topdown=False):
-            for name in files:
-                if name == preserve_file:
-                    logging.info(f"\tDONT REMOVE: [{short_path(preserve_file_path)}]")
-                else:
-                    #logging.info(f"\tRemoving file: [{name}]")
-                    os.remove(os.path.join(root, name))
-            for name in dirs:
-                this_dir = os.path.join(root, name)
-                #logging.info(f"Removing dir: [{this_dir}]")
-                if len(os.listdir(this_dir)) != 0:
-                    logging.info(f"\tRemoving dir: [{this_dir}] NOT EMPTY")
-                #if os.path.exists(this_dir):
-                else:
-                    #logging.info(f"\tRemoving dir: [{name}]")
-                    os.rmdir(os.path.join(root, name))
+        # Read every preserve_file in the tree (except one in glob_pio_folder itself, that one is removed);
+        # they are written back, together with the folders that hold them, after the tree is removed
+        preserved_files = {}
+        for root, _, files in os.walk(glob_pio_folder):
+            if root != glob_pio_folder and preserve_file in files:
+                file_path = os.path.join(root, preserve_file)
+                with open(file_path, 'rb') as f:
+                    preserved_files[file_path] = f.read()
+
+        # Remove the complete PlatformIO tree in one go
+        shutil.rmtree(glob_pio_folder)
+        os.makedirs(glob_pio_project_folder, exist_ok=True)
         
-        list_files_in_directory(glob_pio_folder)
-        # Remove all other contents in the base directory except the preserve_file
-        for item in os.listdir(glob_pio_folder):
-            item_path = os.path.join(glob_pio_folder, item)
-            #if item != preserve_file and os.path.isfile(item_path):
-            if os.path.isfile(item_path):
-                logging.info(f"\tremove: {item_path}")
-                os.remove(item_path)
-            #elif item != last_folder and os.path.isdir(item_path):
-            elif item != glob_pio_folder and os.path.isdir(item_path):
-                logging.info(f"\tRemove tree: {item_path}")
-                #shutil.rmtree(item_path)
-        
-        # Restore or create the preserve_file with its original contents
-        with open(preserve_file_path, 'w') as f:
-            if preserve_file_contents is not None:
-                f.write(preserve_file_contents)
+        # Restore the preserve_files with their original contents
+        for file_path, file_contents in preserved_files.items():
+            logging.info(f"\tDONT REMOVE: [{short_path(file_path)}]")
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as f:
+                f.write(file_contents)
+        # Create the preserve_file of the project if it didn't exist
+        if preserve_file_path not in preserved_files:
+            open(preserve_file_path, 'w').close()
         
         logging.info(f"\tSuccessfully removed all contents in [{short_path(glob_pio_folder)}]")
         logging.info(f"\tand all other contents in [{short_path(glob_pio_folder)}] except [{preserve_file}]")
@@ -603,7 +891,7 @@ def recreate_pio_folders():
     logging.debug(f"\tCurrent working directory: {current_dir}")
 
     # Construct the full base path
-    full_base_path = os.path.join(current_dir, glob_pio_folder, glob_project_name)
+    full_base_path = glob_pio_project_folder
     logging.debug(f"\t  Full base path: {full_base_path}")
     logging.debug(f"\t    glob_pio_src: {glob_pio_src}")
     logging.debug(f"\tglob_pio_include: {glob_pio_include}")
@@ -623,7 +911,7 @@ def insert_include_in_header(header_lines, inserts):
     """
     Insert #include statements in the header file.
     """
-    logging("")
+    logging.info("")
     logging.info("Processing: insert_include_in_header() ..")
 
     includes_to_add = []
@@ -632,15 +920,10 @@ def insert_include_in_header(header_lines, inserts):
     # Process inserts
     for item in inserts:
         class_name = item[0]
-        logging.info(f"\t\tChecking if {class_name} ...")
+        logging.debug("\t\tChecking if %s ...", class_name)
         
         # Check if the class is in dict_singleton_classes
-        singleton_header = None
-        for header, classes in dict_singleton_classes.items():
-            logging.info(f"\t\tChecking if {class_name} is in {header}")
-            if class_name in classes or class_name == header:
-                singleton_header = header
-                break
+        singleton_header = dict_singleton_headers.get(class_name)
         
         if singleton_header:
             if singleton_header not in includes_added:
@@ -658,18 +941,19 @@ def insert_include_in_header(header_lines, inserts):
                 includes_added.add(class_name)
                 logging.debug(f"\t\tAdding <{class_name}.h>")
 
-    # Find the position to insert the new includes
-    insert_position = 0
-    for i, line in enumerate(header_lines):
-        if line.strip().startswith('#include'):
-            insert_position = i + 1
-        elif not line.strip().startswith('#') and line.strip() != '':
-            break
+    # Find the position to insert the new includes: after the last #include
+    # in the leading block of preprocessor (or empty) lines
+    header_text = ''.join(header_lines)
+    first_code_line = first_code_line_re.search(header_text)
+    leading_block_end = first_code_line.start() if first_code_line else len(header_text)
+    # (only the line number of the last #include is needed)
+    include_match = None
+    for include_match in include_line_re.finditer(header_text, 0, leading_block_end):
+        pass
+    insert_position = header_text.count('\n', 0, include_match.start()) + 1 if include_match else 0
 
     # Insert the new includes
-    for include in includes_to_add:
-        header_lines.insert(insert_position, include + '\n')
-        insert_position += 1
+    header_lines[insert_position:insert_position] = [include + '\n' for include in includes_to_add]
 
     return header_lines
 
@@ -679,11 +963,7 @@ def insert_method_include_in_header(header_file, include_statement):
     logging.info("Processing: insert_method_include_in_header() ..")
     try:
         with open(header_file, 'r') as file:
-            content = file.readlines()
-
-        # Find the appropriate position to insert the include statement
-        convertor_marker_position = -1
-        first_comment_end = -1
+            content = file.read()
 
         # Extract the library name from the include statement
         library_name = re.search(r'#include\s*<(.+)>', include_statement)
@@ -693,38 +973,35 @@ def insert_method_include_in_header(header_file, include_statement):
 
         library_name = library_name.group(1)
 
-        for i, line in enumerate(content):
-            stripped_line = line.strip()
-            
-            if stripped_line == convertor_marker:
-                convertor_marker_position = i
-                break
-            
-            if first_comment_end == -1 and (stripped_line.endswith('//') or stripped_line.endswith('*/')):
-                first_comment_end = i
-
-        # If convertor_marker is not found, add it after the first comment
-        if convertor_marker_position == -1 and first_comment_end != -1:
-            content.insert(first_comment_end + 1, f"{convertor_marker}\n")
-            convertor_marker_position = first_comment_end + 1
+        # Find the appropriate position to insert the include statement
+        insert_position = 0
+        marker_match = convertor_marker_line_re.search(content)
+        if marker_match:
+            insert_position = marker_match.end()
+        else:
+            # If convertor_marker is not found, add it after the first comment
+            comment_match = comment_end_line_re.search(content)
+            if comment_match:
+                insert_position = comment_match.end()
+                content = content[:insert_position] + f"\n{convertor_marker}" + content[insert_position:]
+                insert_position += len(f"\n{convertor_marker}")
 
         # Always insert the include statement after the convertor_marker
-        insert_position = convertor_marker_position + 1 if convertor_marker_position != -1 else 0
-        
+        if insert_position > 0:
+            if content.find('\n', insert_position) == -1:
+                content += '\n'
+            insert_position = content.find('\n', insert_position) + 1
+
         # Check if the include statement already exists, ignoring comments
-        include_exists = any(
-            re.search(rf'#include\s*<{re.escape(library_name)}>\s*(//.*)?$', line.strip())
-            for line in content
-        )
-        
+        include_exists = library_include_re(library_name).search(content)
+
         if not include_exists:
-            content.insert(insert_position, f"{include_statement}\t\t//-- added by instance.method()\n")
+            content = content[:insert_position] + f"{include_statement}\t\t//-- added by instance.method()\n" + content[insert_position:]
             logging.debug(f"\tInserted include statement in {short_path(header_file)}: {include_statement}")
         else:
             logging.debug(f"\tInclude statement already exists in {short_path(header_file)}: {include_statement}")
         
-        with open(header_file, 'w') as file:
-            file.writelines(content)
+        write_file(header_file, content)
     
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -743,7 +1020,7 @@ def copy_data_folder():
     logging.info("Processing: copy_data_folder()")
 
     source_data_folder = os.path.join(glob_ino_project_folder, 'data')
-    destination_data_folder = os.path.join(glob_pio_folder, glob_project_name, 'data')
+    destination_data_folder = os.path.join(glob_pio_project_folder, 'data')
 
     # Delete existing data folder in glob_pio_folder if it exists
     if os.path.exists(destination_data_folder):
@@ -772,249 +1049,291 @@ def copy_data_folder():
             exc_type, exc_obj, exc_tb = sys.exc_info()
             #fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             line_number = exc_tb.tb_lineno
-            logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
-            logging.error(f"\tError deleting existing data folder: {str(e)}")
-            logging.error(f"\tError copying data folder: {str(e)}")
-    else:
-        logging.info("\tNo data folder found in the project folder")
-
-#------------------------------------------------------------------------------------------------------
-def create_platformio_ini():
-    """Create a platformio.ini file if it doesn't exist."""
-    logging.info("")
-    logging.info(f"Processing: create _platformio_ini() if it doesn't exist in [{short_path(glob_pio_project_folder)}]")
-
-    platformio_ini_path = os.path.join(glob_pio_project_folder, 'platformio.ini')
-    if not os.path.exists(platformio_ini_path):
-        platformio_ini_content = """
-; PlatformIO Project Configuration File
-;
-;   Build options: build flags, source filter
-;   Upload options: custom upload port, speed and extra flags
-;   Library options: dependencies, extra library storages
-;   Advanced options: extra scripting
-;
-; Please visit documentation for the other options and examples
-; https://docs.platformio.org/page/projectconf.html
-
-[platformio]
-workspace_dir = .pio.nosync
-default_envs = myBoard
-
-[env:myBoard]
-;-- esp32
-#platform = espressif32
-#board = esp32dev
-#framework = arduino
-#board_build.partitions = <min_spiffs.csv>
-#board_build.filesystem = <LittleFS>|<SPIFFS>
-#monitor_speed = 115200
-#upload_speed = 115200
-#build_flags =
-#\t-D DEBUG
-#
-#lib_ldf_mode = deep+
-#
-#lib_deps =
-;\t<select libraries with "PIO Home" -> Libraries
-
-##-- you NEED the next line (with the correct port)
-##-- or the data upload will NOT work!
-#upload_port = </dev/serial_port>
-#monitor_filters =
-#  esp32_exception_decoder
-
-;-- esp8266
-#platform = espressif8266
-#board = esp12e
-#framework = arduino
-##-- you NEED the next line (with the correct port)
-##-- or the data upload will NOT work!
-#upload_port = </dev/serial_port>
-#board_build.filesystem = <littlefs>|<spiffs>
-#build_flags =
-#\t-D DEBUG
-#
-#lib_ldf_mode = deep+
-#
-#lib_deps =
-;\t<select libraries with "PIO Home" -> Libraries
-#monitor_filters =
-#  esp8266_exception_decoder
-
-;-- attiny85
-#platform = atmelavr
-#board = attiny85
-#framework = arduino
-#upload_protocol = usbtiny
-#upload_speed = 19200
-;-- Clock source Int.RC Osc. 8MHz PWRDWN/RESET: 6 CK/1
-#board_fuses.lfuse = 0xE2
-;-- Serial program downloading (SPI) enabled
-;-- brown-out Detection 1.8v (0xDE)
-;board_fuses.hfuse = 0xDE    
-;-- brown-out detection 2.7v (0xDD)
-#board_fuses.hfuse = 0xDD    
-;-- brown-out detection 4.3v (0xDC)
-;board_fuses.hfuse = 0xDC    
-#board_fuses.efuse = 0xFF
-
-#framework = arduino
-#board_build.filesystem = LittleFS
-#monitor_speed = 115200
-#upload_speed = 115200
-#upload_port = <select port like "/dev/cu.usbserial-3224144">
-#build_flags =
-#\t-D DEBUG
-#
-#lib_ldf_mode = deep+
-#
-#lib_deps =
-;\t<select libraries with "PIO Home" -> Libraries
-"""
-        with open(platformio_ini_path, 'w') as f:
+            logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
+            logging.error(f"\tError deleting existing data folder: {str(e)}")
+            logging.error(f"\tError copying data folder: {str(e)}")
+    else:
+        logging.info("\tNo data folder found in the project folder")
+
+#------------------------------------------------------------------------------------------------------
+def create_platformio_ini():
+    """Create a platformio.ini file if it doesn't exist."""
+    logging.info("")
+    logging.info(f"Processing: create _platformio_ini() if it doesn't exist in [{short_path(glob_pio_project_folder)}]")
+
+    platformio_ini_path = os.path.join(glob_pio_project_folder, 'platformio.ini')
+    try:
+        # 'x' only creates the file if it doesn't exist yet (no separate exists() check)
+        with open(platformio_ini_path, 'x') as f:
             f.write(platformio_ini_content)
             logging.info(f"\tCreated platformio.ini file at {short_path(platformio_ini_path)}")
 
-    else:  
+    except FileExistsError:
         logging.info(f"\tplatformio.ini file already exists at [{short_path(platformio_ini_path)}]")
 
 
 #------------------------------------------------------------------------------------------------------
-def move_struct_union_and_enum_declarations():
+def extract_defines_and_move_declarations():
+    """
+    Extract all #define statements (including functional and multi-line) and all global
+    struct/union/enum declarations from the .h and .ino files, comment them out in the
+    original files and insert them into arduinoGlue.h.
+    Every file is read and written only once for both.
+    """
     logging.info("")
-    logging.info(f"Processing: move_struct_union_and_enum_declarations() ")
+    logging.info(f"Searching for #define statements in {short_path(glob_pio_folder)}")
 
     global struct_union_and_enum_added
 
+    # Only search within glob_pio_src and glob_pio_include folders
     search_folders = [glob_pio_src, glob_pio_include]
+    define_comment_prefix = b"\t//-- moved to arduinoGlue.h // "
+    mmap_min_size = 64 * 1024
+    line_separator = os.linesep.encode()
+
+    # The files are processed as bytes (the sources are ASCII, so there is no need to decode them);
+    # line endings are normalized on read and restored on write, just like text mode does
+    def normalize_line_endings(content):
+        return content.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+    def restore_line_endings(content):
+        if line_separator != b'\n':
+            return content.replace(b'\n', line_separator)
+        return content
+
+    def comment_out_defines(content):
+        defines = []        # (macro_name, full_define)
+        new_content = []    # output pieces, spliced together once
+        cursor = 0
+        # define_re matches the whole (multi-line) #define at once
+        for match in define_re.finditer(content):
+            # Don't include header guards
+            if not match.group(1).endswith(b'_H'):
+                full_define = match.group(0)
+                defines.append((match.group(1), full_define))
+                # Comment out the original #define with info
+                new_content.append(content[cursor:match.start()])
+                new_content.append(define_comment_prefix + full_define.replace(b'\n', b'\n' + define_comment_prefix))
+                cursor = match.end()
+
+        if not defines:
+            return content, defines
+        new_content.append(content[cursor:])
+        return b''.join(new_content), defines
 
     def find_declaration_end(content, start_pos):
         bracket_count = 0
-        for i, char in enumerate(content[start_pos:]):
-            if char == '{':
+        # Jump from brace to brace instead of walking every character
+        for brace_match in brace_re.finditer(content, start_pos):
+            if brace_match.group() == b'{':
                 bracket_count += 1
-            elif char == '}':
+            else:
                 bracket_count -= 1
                 if bracket_count == 0:
-                    # Look for the semicolon after the closing brace
-                    semicolon_pos = content.find(';', start_pos + i)
+                    # Look for the semicolon after the closing brace (bytes.find() is a memchr() scan)
+                    semicolon_pos = content.find(b';', brace_match.end())
                     if semicolon_pos != -1:
                         return semicolon_pos + 1
-                    return start_pos + i + 1
+                    return brace_match.end()
         return -1
 
-    def is_in_comment(content, pos):
-        # Check for single-line comment
-        line_start = content.rfind('\n', 0, pos) + 1
-        if '//' in content[line_start:pos]:
-            return True
+    def find_comment_spans(content):
+        # All (start, end) comment ranges, found in one pass
+        comment_spans = [(m.start(), m.end()) for m in comment_span_re.finditer(content)]
+        return [start for start, _ in comment_spans], comment_spans
+
+    def is_in_comment(comment_starts, comment_spans, pos):
+        # Binary search for the last comment starting before pos
+        i = bisect_right(comment_starts, pos) - 1
+        return i >= 0 and comment_spans[i][1] > pos
+
+    def move_declarations(content, file_name):
+        # Fast reject: no need to scan files without any of the keywords
+        if b'struct' not in content and b'union' not in content and b'enum' not in content:
+            return content, []
+
+        declarations_to_move = []
+        replacements = []   # (start_pos, end_pos, commented_decl)
+        brace_level = 0
+        brace_level_pos = 0
+        comment_starts, comment_spans = find_comment_spans(content)
+
+        # declaration_re matches struct, union, and enum declarations, including 'typedef struct'
+        for match in declaration_re.finditer(content):
+            start_pos = match.start()
+
+            # Skip if the declaration is inside a comment
+            if is_in_comment(comment_starts, comment_spans, start_pos):
+                continue
 
-        # Check for multi-line comment
-        last_comment_start = content.rfind('/*', 0, pos)
-        if last_comment_start != -1:
-            comment_end = content.find('*/', last_comment_start)
-            if comment_end == -1 or comment_end > pos:
-                return True
+            end_pos = find_declaration_end(content, start_pos)
+
+            if end_pos != -1:
+                decl_type = match.group(2)  # b'struct', b'union', or b'enum'
+                decl = content[start_pos:end_pos]
+
+                # Check if the declaration is globally defined (not inside a function)
+                # (matches come in order, so only count the braces since the previous one)
+                brace_level += content.count(b'{', brace_level_pos, start_pos) - content.count(b'}', brace_level_pos, start_pos)
+                brace_level_pos = start_pos
+
+                if brace_level == 0:  # Declaration is globally defined
+                    # Prepare the declaration for arduinoGlue.h
+                    arduinoGlue_decl = b"//-- from " + file_name.encode() + b"\n" + decl
+                    declarations_to_move.append(arduinoGlue_decl)
+
+                    # Comment out the declaration in the original file
+                    comment_text = b"*** " + decl_type + b" moved to arduinoGlue.h ***"
+                    commented_decl = b"/*\t\t\t\t" + comment_text + b"\n" + decl + b"\n*/"
+                    replacements.append((start_pos, end_pos, commented_decl))
+
+        if not replacements:
+            return content, declarations_to_move
+
+        # Splice all commented declarations into the content in one pass
+        modified_parts = []
+        cursor = 0
+        for start_pos, end_pos, commented_decl in replacements:
+            # A declaration starting inside the previous one (that one had no ';' of its own)
+            # is still moved, but its text is left as it is, like the old str.replace() did
+            if start_pos < cursor:
+                continue
+            modified_parts.append(content[cursor:start_pos])
+            modified_parts.append(commented_decl)
+            cursor = end_pos
+        modified_parts.append(content[cursor:])
+        return b''.join(modified_parts), declarations_to_move
+
+    def process_file(file_path):
+        # Read, transform and rewrite one file; returns its defines and declarations (None on I/O errors)
+        file_name = os.path.basename(file_path)
+        try:
+            # Read and rewrite the file through a single handle
+            with open(file_path, 'r+b') as file:
+                # A large file is searched through a memory map first: without anything to
+                # move (or line endings to restore) it doesn't have to be read at all
+                if line_separator == b'\n' and os.fstat(file.fileno()).st_size >= mmap_min_size:
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                        keywords = (b'#define', b'\r') if file_name.startswith('arduinoGlue') else (b'#define', b'\r', b'struct', b'union', b'enum')
+                        if all(mapped_file.find(keyword) == -1 for keyword in keywords):
+                            return file_path, [], []
+
+                original_content = file.read()
+                content, defines = comment_out_defines(normalize_line_endings(original_content))
+
+                declarations_to_move = []
+                if not file_name.startswith('arduinoGlue'):
+                    content, declarations_to_move = move_declarations(content, file_name)
+
+                # Write the modified content back to the original file (File Under Test)
+                content = restore_line_endings(content)
+                if content != original_content:
+                    file.seek(0)
+                    file.write(content)
+                    file.truncate()
+
+            return file_path, defines, declarations_to_move
+
+        except FileNotFoundError:
+            logging.error(f"Error: File {file_path} not found.")
+        except IOError:
+            logging.error(f"Error: Unable to read or write file {file_path}.")
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            line_number = exc_tb.tb_lineno
+            logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
+            exit()
+        return file_path, None, None
 
-        return False
+    file_paths = [file_path for folder in search_folders for file_path in walk_files(folder, ('.h', '.ino'))]
 
-    for folder in search_folders:
-        for root, _, files in os.walk(folder):
-            for file in files:
-                #??#if file.endswith(('.h', '.ino', '.cpp')) and not file.startswith('arduinoGlue'):
-                if file.endswith(('.h', '.ino')) and not file.startswith('arduinoGlue'):
-                    file_path = os.path.join(root, file)
-                    logging.debug(f"\tProcessing file: {short_path(file_path)}")
+    results = []
+    for file_path in file_paths:
+        result = process_file(file_path)
+        if result[1] is not None:
+            results.append(result)
 
-                    try:
-                        with open(file_path, 'r') as file:
-                            content = file.read()
+    all_defines = []
+    for file_path, defines, _ in results:
+        logging.debug("\tProcessing file: %s", short_path(file_path))
+        for macro_name, full_define in defines:
+            all_defines.append(full_define)
+            logging.debug("\tAdded #define: %s", macro_name.decode())
+        logging.debug("\tUpdated %s with commented out #defines", os.path.basename(file_path))
 
-                        # Updated regular expression to match struct, union, and enum declarations, including 'typedef struct'
-                        declaration_pattern = r'\b(typedef\s+)?(struct|union|enum)\s+(?:\w+\s+)*(?:\w+\s*)?{'
+    logging.info(f"\tInserted {len(all_defines)} #define statements into {short_path(glob_pio_arduinoGlue)}")
 
-                        modified_content = content
-                        declarations_to_move = []
+    logging.info("")
+    logging.info("Processing: struct/union/enum declarations")
+
+    # Collect the declarations of all files, so arduinoGlue.h is read and written only once
+    declaration_blocks = []
+    for file_path, _, declarations_to_move in results:
+        if os.path.basename(file_path).startswith('arduinoGlue'):
+            continue
+        logging.debug("\tProcessing file: %s", short_path(file_path))
+        if declarations_to_move:
+            struct_union_and_enum_added = True
+            # Ensure there's an empty line before the declarations and one after each declaration
+            declaration_blocks.append(b'\n' + b'\n'.join(decl + b'\n' for decl in declarations_to_move))
+            logging.info(f"\tMoved {len(declarations_to_move)} struct/union/enum declaration(s) from [{os.path.basename(file_path)}] to arduinoGlue.h")
+        else:
+            logging.info(f"\tNo global struct/union/enum declarations found in [{os.path.basename(file_path)}]")
 
-                        for match in re.finditer(declaration_pattern, content):
-                            start_pos = match.start()
-                            
-                            # Skip if the declaration is inside a comment
-                            if is_in_comment(content, start_pos):
-                                continue
+    try:
+        arduinoGlue_path = glob_pio_arduinoGlue
+        with open(arduinoGlue_path, 'r+b') as file:
+            original_content = file.read()
+            arduinoGlue_content = normalize_line_endings(original_content)
 
-                            end_pos = find_declaration_end(content, start_pos)
-                            
-                            if end_pos != -1:
-                                decl_type = match.group(2)  # 'struct', 'union', or 'enum'
-                                decl = content[start_pos:end_pos]
-                                
-                                # Check if the declaration is globally defined (not inside a function)
-                                preceding_content = content[:start_pos]
-                                brace_level = preceding_content.count('{') - preceding_content.count('}')
-                                
-                                if brace_level == 0:  # Declaration is globally defined
-                                    # Prepare the declaration for arduinoGlue.h
-                                    arduinoGlue_decl = f"//-- from {os.path.basename(file_path)}\n{decl}"
-                                    declarations_to_move.append(arduinoGlue_decl)
-
-                                    # Comment out the declaration in the original file
-                                    comment_text = f"*** {decl_type} moved to arduinoGlue.h ***"
-                                    commented_decl = f"/*\t\t\t\t{comment_text}\n{decl}\n*/"
-                                    modified_content = modified_content.replace(content[start_pos:end_pos], commented_decl)
-                                    struct_union_and_enum_added = True
-
-                        # Write modified content back to the original file (File Under Test)
-                        with open(file_path, 'w') as file:
-                            file.write(modified_content)
-
-                        # Insert declarations into arduinoGlue.h at the correct position
-                        if declarations_to_move:
-                            arduinoGlue_path = os.path.join(glob_pio_include, 'arduinoGlue.h')
-                            with open(arduinoGlue_path, 'r+') as file:
-                                arduinoGlue_content = file.read()
-                                
-                                # Find the correct insertion point
-                                header_guard_match = re.search(r'#ifndef\s+\w+\s+#define\s+\w+', arduinoGlue_content)
-                                if header_guard_match:
-                                    header_guard_end = header_guard_match.end()
-                                    # Find the struct_union_and_enum_marker after the header guard
-                                    struct_union_and_enum_marker_pos = arduinoGlue_content.rfind(f"{struct_union_and_enum_marker}", header_guard_end)
-                                    logging.info(f"\t\tstruct_union_and_enum_marker_pos: {struct_union_and_enum_marker_pos}")
-                                    if struct_union_and_enum_marker_pos != -1:
-                                        insert_point = arduinoGlue_content.find('\n', struct_union_and_enum_marker_pos) + 0
-                                    else:
-                                        # If no #define found, insert after header guard
-                                        insert_point = arduinoGlue_content.find('\n', header_guard_end) + 1
-                                else:
-                                    # If no header guard found, insert at the beginning
-                                    insert_point = 0
-                                logging.info(f"\t\tinsert_point: {insert_point}")
-
-                                # Ensure there's an empty line before the declarations and one after each declaration
-                                new_content = arduinoGlue_content[:insert_point] + '\n'
-                                new_content += '\n'.join(decl + '\n' for decl in declarations_to_move)
-                                new_content += arduinoGlue_content[insert_point:]
-                                
-                                # Write the updated content back to arduinoGlue.h
-                                file.seek(0)
-                                file.write(new_content)
-                                file.truncate()
-
-                            logging.info(f"\tMoved {len(declarations_to_move)} struct/union/enum declaration(s) from [{os.path.basename(file_path)}] to arduinoGlue.h")
-                        else:
-                            logging.info(f"\tNo global struct/union/enum declarations found in [{os.path.basename(file_path)}]")
-
-                    except FileNotFoundError:
-                        logging.error(f"Error: File {file_path} not found.")
-                    except IOError:
-                        logging.error(f"Error: Unable to read or write file {file_path}.")
-                    except Exception as e:
-                        exc_type, exc_obj, exc_tb = sys.exc_info()
-                        line_number = exc_tb.tb_lineno
-                        logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
-                        exit()
+            # Insert all defines into arduinoGlue.h after the all_defines_marker
+            marker_index = arduinoGlue_content.find(all_defines_marker.encode())
+            if marker_index != -1:
+                marker_end = marker_index + len(all_defines_marker)
+                arduinoGlue_content = (arduinoGlue_content[:marker_end] +
+                                       b'\n' + b'\n'.join(all_defines) +
+                                       arduinoGlue_content[marker_end:])
+
+            # Insert declarations into arduinoGlue.h at the correct position
+            if declaration_blocks:
+                # Find the correct insertion point
+                header_guard_match = header_guard_block_bytes_re.search(arduinoGlue_content)
+                if header_guard_match:
+                    header_guard_end = header_guard_match.end()
+                    # Find the struct_union_and_enum_marker after the header guard
+                    struct_union_and_enum_marker_pos = arduinoGlue_content.rfind(struct_union_and_enum_marker.encode(), header_guard_end)
+                    logging.info(f"\t\tstruct_union_and_enum_marker_pos: {struct_union_and_enum_marker_pos}")
+                    if struct_union_and_enum_marker_pos != -1:
+                        insert_point = arduinoGlue_content.find(b'\n', struct_union_and_enum_marker_pos) + 0
+                    else:
+                        # If no #define found, insert after header guard
+                        insert_point = arduinoGlue_content.find(b'\n', header_guard_end) + 1
+                else:
+                    # If no header guard found, insert at the beginning
+                    insert_point = 0
+                logging.info(f"\t\tinsert_point: {insert_point}")
+
+                # Every file used to be inserted at the same point, so the last file ends up first
+                arduinoGlue_content = (arduinoGlue_content[:insert_point] +
+                                       b''.join(reversed(declaration_blocks)) +
+                                       arduinoGlue_content[insert_point:])
+
+            # Write the updated content back to arduinoGlue.h
+            arduinoGlue_content = restore_line_endings(arduinoGlue_content)
+            if arduinoGlue_content != original_content:
+                file.seek(0)
+                file.write(arduinoGlue_content)
+                file.truncate()
+
+    except FileNotFoundError:
+        logging.error(f"Error: File {glob_pio_arduinoGlue} not found.")
+    except IOError:
+        logging.error(f"Error: Unable to read or write file {glob_pio_arduinoGlue}.")
+    except Exception as e:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        line_number = exc_tb.tb_lineno
+        logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
+        exit()
 
 
 """
@@ -1116,100 +1435,6 @@ def extract_and_comment_defines():
 
     logging.info(f"\tExtracted {len(all_defines)} #define statements")
 """
-#------------------------------------------------------------------------------------------------------
-#------------------------------------------------------------------------------------------------------
-def extract_and_comment_defines():
-    """
-    Extract all #define statements (including functional and multi-line) from .h, .ino, and .cpp files,
-    comment original statements with info, and insert them into arduinoGlue.h after the all_defines_marker.
-    """
-    logging.info("")
-    logging.info(f"Searching for #define statements in {short_path(glob_pio_folder)}")
-
-    try:
-        all_defines = []
-        define_pattern = r'^\s*#define\s+(\w+)(?:\(.*?\))?\s*(.*?)(?:(?=\\\n)|$)'
-
-        # Only search within glob_pio_src and glob_pio_include folders
-        search_folders = [glob_pio_src, glob_pio_include]
-
-        for folder in search_folders:
-            for root, _, files in os.walk(folder):
-                for file in files:
-                    if file.endswith(('.h', '.ino')):
-                        file_path = os.path.join(root, file)
-                        logging.debug(f"\tProcessing file: {short_path(file_path)}")
-                        with open(file_path, 'r') as f:
-                            content = f.read()
-
-                        new_content = []
-                        lines = content.split('\n')
-                        i = 0
-                        while i < len(lines):
-                            line = lines[i]
-                            match = re.match(define_pattern, line)
-                            if match:
-                                macro_name = match.group(1)
-                                macro_value = match.group(2)
-                                full_define = [line]
-
-                                # Check for multi-line defines
-                                while macro_value.endswith('\\') and i + 1 < len(lines):
-                                    i += 1
-                                    next_line = lines[i]
-                                    full_define.append(next_line)
-                                    macro_value += '\n' + next_line.strip()
-                                    
-                                # Add the closing line if it's not already included
-                                if i + 1 < len(lines) and not macro_value.endswith('\\'):
-                                    i += 1
-                                    closing_line = lines[i]
-                                    if closing_line.strip().startswith(')'):
-                                        full_define.append(closing_line)
-                                        macro_value += '\n' + closing_line.strip()
-                                    else:
-                                        i -= 1  # If it's not a closing parenthesis, go back one line
-
-                                # Don't include header guards
-                                if not macro_name.endswith('_H'):
-                                    all_defines.append('\n'.join(full_define))
-                                    # Comment out the original #define with info
-                                    new_content.extend([f"\t//-- moved to arduinoGlue.h // {line}" for line in full_define])
-                                    logging.debug(f"\tAdded #define: {macro_name}")
-                                else:
-                                    new_content.extend(full_define)
-                            else:
-                                new_content.append(line)
-                            i += 1
-
-                        # Write the modified content back to the file
-                        with open(file_path, 'w') as f:
-                            f.write('\n'.join(new_content))
-                        logging.debug(f"\tUpdated {file} with commented out #defines")
-
-        # Insert all defines into arduinoGlue.h after the all_defines_marker
-        all_defines_path = os.path.join(glob_pio_include, 'arduinoGlue.h')
-        with open(all_defines_path, 'r') as f:
-            content = f.read()
-
-        marker_index = content.find(all_defines_marker)
-        if marker_index != -1:
-            new_content = (content[:marker_index + len(all_defines_marker)] + 
-                           '\n' + '\n'.join(all_defines) + 
-                           content[marker_index + len(all_defines_marker):])
-            
-            with open(all_defines_path, 'w') as f:
-                f.write(new_content)
-
-        logging.info(f"\tInserted {len(all_defines)} #define statements into {short_path(all_defines_path)}")
-
-    except Exception as e:
-        exc_type, exc_obj, exc_tb = sys.exc_info()
-        line_number = exc_tb.tb_lineno
-        logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
-        logging.error(f"\tError extracting and inserting #define statements: {str(e)}")
-        exit()
-
 #------------------------------------------------------------------------------------------------------
 def add_markers_to_header_file(file_path):
     logging.info("")
@@ -1256,20 +1481,23 @@ def add_markers_to_header_file(file_path):
         else:
             insertion_point = 0
 
-        # Insert markers
+        # Collect the marker lines (each followed by an empty line, unless appended at the end)
+        inserts = []
+        line_count = len(lines)
         for marker in markers:
             if marker not in content:
-                lines.insert(insertion_point, marker)
-                insertion_point += 1
-            if insertion_point < len(lines):
-                lines.insert(insertion_point, '')
-                insertion_point += 1
-
-        # Join lines back into content
-        modified_content = '\n'.join(lines)
+                inserts.append(marker)
+            if insertion_point < line_count:
+                inserts.append('')
+
+        # Splice them into the content at the start of the insertion line
+        if insertion_point < line_count:
+            insert_pos = sum(len(line) + 1 for line in lines[:insertion_point])
+            modified_content = content[:insert_pos] + ''.join(f"{line}\n" for line in inserts) + content[insert_pos:]
+        else:
+            modified_content = content + ''.join(f"\n{line}" for line in inserts)
 
-        with open(file_path, 'w') as file:
-            file.write(modified_content)
+        write_file(file_path, modified_content)
                     
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -1324,15 +1552,15 @@ def process_original_header_file(header_path, base_name):
             with open(header_path, 'r') as f:
                 original_content = f.read()
             
-            # Check for existing header guards
-            guard_match = re.search(r'#ifndef\s+(\w+_H).*?#define\s+\1', original_content, re.DOTALL)
+            # Check for existing header guards (no need to run the regex without any #ifndef)
+            guard_match = header_guard_re.search(original_content) if '#ifndef' in original_content else None
             has_guards = guard_match is not None
 
             new_content = original_content
 
             if not has_guards:
                 # Add header guards if they don't exist
-                logging.debug(f"\tAdding header guards for {base_name}")
+                logging.debug("\tAdding header guards for %s", base_name)
                 guard_name = f"{base_name.upper()}_H"
                 new_content = f"#ifndef {guard_name}\n#define {guard_name}\n\n{new_content}\n#endif // {guard_name}\n"
             else:
@@ -1340,7 +1568,7 @@ def process_original_header_file(header_path, base_name):
 
             # Find the position to insert the all_includes_marker
             if all_includes_marker not in new_content:
-                logging.debug(f"\tAdding {all_includes_marker} to {base_name}")
+                logging.debug("\tAdding %s to %s", all_includes_marker, base_name)
                 # Find the first closing comment after the header guard
                 comment_end = new_content.find('*/', new_content.find(guard_name)) + 2
                 if comment_end > 1:  # If a closing comment was found
@@ -1352,20 +1580,19 @@ def process_original_header_file(header_path, base_name):
 
             # Check if arduinoGlue.h is already included
             if '#include "arduinoGlue.h"' not in new_content:
-                logging.debug(f"\tAdding arduinoGlue.h include to {base_name}")
+                logging.debug("\tAdding arduinoGlue.h include to %s", base_name)
                 # Insert after the convertor_markerloca
                 insert_pos = new_content.find('\n', new_content.find(all_includes_marker)) + 1
                 new_content = new_content[:insert_pos] + '#include "arduinoGlue.h"\n\n' + new_content[insert_pos:]
 
             # Only write to the file if changes were made
             if new_content != original_content:
-                with open(header_path, 'w') as f:
-                    f.write(new_content)
-                logging.debug(f"\tUpdated original header file: {short_path(header_path)}")
+                write_file(header_path, new_content)
+                logging.debug("\tUpdated original header file: %s", short_path(header_path))
             else:
-                logging.debug(f"\tNo changes needed for: {short_path(header_path)}")
+                logging.debug("\tNo changes needed for: %s", short_path(header_path))
         else:
-            logging.debug(f"\tFile not found: {short_path(header_path)}")
+            logging.debug("\tFile not found: %s", short_path(header_path))
 
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -1390,29 +1617,33 @@ def add_local_includes_to_project_header():
 
     try:
         project_header = os.path.join(glob_pio_include, f"{glob_project_name}.h")
+
+        # Collect the candidate headers first, the project header only has to be read if there are any
+        # Reuse the listing that is logged anyway instead of scanning the folder a second time
+        candidate_headers = []
+        for file_name in list_files_in_directory(glob_pio_include):
+            logging.debug(f"\tProcessing file: {file_name}")
+            header_name = os.path.basename(file_name)  # Get the basename
+            if header_name == os.path.basename(project_header):
+                logging.info(f"Don't ever include {header_name} into {os.path.basename(project_header)}")
+            else:
+                candidate_headers.append(header_name)
+
+        if not candidate_headers:
+            return   # No new includes to add
+
         # Read the content of the source file
         with open(project_header, 'r') as file:
             content = file.read()
 
-        # Remove multi-line comments
-        content_without_multiline_comments = re.sub(r'/\*[\s\S]*?\*/', '', content)
-        
-        # Remove single-line comments
-        content_without_comments = re.sub(r'//.*$', '', content_without_multiline_comments, flags=re.MULTILINE)
+        # Remove multi-line and single-line comments in one pass
+        content_without_comments = comment_re.sub('', content)
 
         # Find all includes that are not commented out
-        existing_includes = set(re.findall(r'#include\s*[<"]([^>"]+)[>"]', content_without_comments))
+        existing_includes = set(map(itemgetter(1), include_name_re.finditer(content_without_comments)))
 
         # Prepare new includes
-        list_files_in_directory(glob_pio_include)
-        new_includes = []
-        for file_name in os.listdir(glob_pio_include):
-            logging.debug(f"\tProcessing file: {file_name}")
-            header_name = os.path.basename(file_name)  # Get the basename
-            if header_name == os.path.basename(project_header):
-                logging.info(f"Don't ever include {header_name} into {os.path.basename(project_header)}")
-            elif header_name not in existing_includes:
-                new_includes.append(f'#include "{header_name}"')
+        new_includes = [f'#include "{header_name}"' for header_name in candidate_headers if header_name not in existing_includes]
 
         if not new_includes:
             return   # No new includes to add
@@ -1428,7 +1659,7 @@ def add_local_includes_to_project_header():
             if insertion_point == -1:
                 # If neither marker is found, find the end of the header guard
                 marker = ""
-                header_guard_end = re.search(r'#define\s+\w+_H\s*\n', content)
+                header_guard_end = header_guard_define_re.search(content)
                 if header_guard_end:
                     insertion_point = header_guard_end.end()
                 else:
@@ -1442,8 +1673,7 @@ def add_local_includes_to_project_header():
         new_content = before + '\n' + '\n'.join(new_includes) + '\n' + after
         
         # Write the modified content back to the header file
-        with open(project_header, 'w') as file:
-            file.write(new_content)
+        write_file(project_header, new_content)
 
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -1460,7 +1690,7 @@ def copy_project_files():
     try:
         # Remove the arduinoGlue.h file
         # Check if the file exists
-        arduinoGlue_path = os.path.join(glob_pio_include, "arduinoGlue.h")
+        arduinoGlue_path = glob_pio_arduinoGlue
         if os.path.exists(arduinoGlue_path):
             # Delete the file
             os.remove(arduinoGlue_path)
@@ -1468,23 +1698,22 @@ def copy_project_files():
         else:
           logging.info("\t'arduinoGlue.h' does not (yet) exist.")
 
-        for file in os.listdir(glob_ino_project_folder):
-            if file.endswith('.ino'):
-                logging.debug(f"\tCopy [{file}] ..")
-                shutil.copy2(os.path.join(glob_ino_project_folder, file), glob_pio_src)
-            elif file.endswith('.cpp'):
-                logging.debug(f"\tCopy [{file}] ..")
-                shutil.copy2(os.path.join(glob_ino_project_folder, file), glob_pio_src)
-            elif file.endswith('.c'):
-                logging.debug(f"\tCopy [{file}] ..")
-                shutil.copy2(os.path.join(glob_ino_project_folder, file), glob_pio_src)
-            elif file.endswith('.h'):
+        # Destination folder per file extension
+        destination_folders = {'.ino': glob_pio_src, '.cpp': glob_pio_src, '.c': glob_pio_src, '.h': glob_pio_include}
+
+        with os.scandir(glob_ino_project_folder) as entries:
+            for entry in entries:
+                file = entry.name
+                base_name, extension = os.path.splitext(file)
+                destination_folder = destination_folders.get(extension)
+                if destination_folder is None or not entry.is_file():
+                    continue
                 logging.debug(f"\tCopy [{file}] ..")
-                shutil.copy2(os.path.join(glob_ino_project_folder, file), glob_pio_include)
-                logging.info(f"\tProcessing original header file: {file}")
-                base_name = os.path.splitext(file)[0]
-                header_path = os.path.join(glob_pio_include, f"{base_name}.h")
-                process_original_header_file(header_path, base_name)
+                shutil.copy2(entry.path, os.path.join(destination_folder, file))
+                if extension == '.h':
+                    logging.info(f"\tProcessing original header file: {file}")
+                    header_path = os.path.join(glob_pio_include, file)
+                    process_original_header_file(header_path, base_name)
 
         if args.debug:
             list_files_in_directory(glob_pio_src)
@@ -1514,28 +1743,20 @@ def extract_all_includes_from_file(file_path):
     includes = []
 
     try:
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
+        content = read_file_contents(file_path)
 
-        modified_lines = []
-        for line in lines:
-            stripped_line = line.strip()
-            if stripped_line.startswith("#include <"):
-                include_match = re.match(r'(#include\s*<[^>]+>|#include\s*"[^"]+")', stripped_line)
-                if include_match:
-                    include_statement = include_match.group(1)
-                    includes.append(include_statement)
-                    # Remove original comment and add the new comment
-                    modified_line = f"//{include_statement:<50}\t\t//-- moved to arduinoGlue.h\n"
-                    modified_lines.append(modified_line)
-                else:
-                    modified_lines.append(line)
-            else:
-                modified_lines.append(line)
+        def comment_out_include(include_match):
+            include_statement = include_match.group(1)
+            includes.append(include_statement)
+            # Remove original comment and add the new comment
+            return f"//{include_statement:<50}\t\t//-- moved to arduinoGlue.h\n"
+
+        # Every line starting with "#include <...>" is replaced in one pass
+        modified_content = angle_include_line_re.sub(comment_out_include, content)
 
         # Write the modified content back to the file
-        with open(file_path, 'w') as file:
-            file.writelines(modified_lines)
+        if includes:
+            write_file_contents(file_path, modified_content)
 
         logging.info(f"Processed {os.path.basename(file_path)}")
         logging.info(f"Found and modified {len(includes)} include statements")
@@ -1555,29 +1776,20 @@ def extract_global_variables(file_path):
     Extract global variable definitions from a single .ino, .cpp, or header file.
     Only variables declared outside of all function blocks are considered global.
     """
+    # Get the file name and the fbase (filename without extension) once
+    file = os.path.basename(file_path)
+    fbase = os.path.splitext(file)[0]
+
     logging.info("")
-    logging.info(f"Processing: extract_global_variables() from : {os.path.basename(file_path)}")
+    logging.info(f"Processing: extract_global_variables() from : {file}")
 
     global_vars = {}
 
-    # Get the fbase (filename without extension)
-    file = os.path.basename(file_path)
-    fbase = os.path.splitext(file)[0]
-
     # Check if there are existing entries in dict_global_variables for this fbase
     if fbase in dict_global_variables:
         global_vars[fbase] = dict_global_variables[fbase]
         logging.info(f"\t[1] Found {len(global_vars[fbase])} existing global variables for {fbase} in dict_global_variables")
 
-    # More flexible type pattern to match any type, including custom types and structs
-    type_pattern = r'(?:\w+(?:::\w+)*(?:\s*<[^>]+>)?(?:\s*\*)*)'
-
-    # Updated patterns to catch all types of variables and class instances, including static
-    var_pattern = rf'^\s*((?:static|volatile|const)?\s*{type_pattern})\s+((?:[a-zA-Z_]\w*(?:\[.*?\])?(?:\s*=\s*[^,;]+)?\s*,\s*)*[a-zA-Z_]\w*(?:\[.*?\])?(?:\s*=\s*[^,;]+)?)\s*;'
-    class_instance_pattern = rf'^\s*((?:static)?\s*{type_pattern})\s+([a-zA-Z_]\w*)(?:\s*\(.*?\))?\s*;'
-    func_pattern = rf'^\s*(?:static|volatile|const)?\s*{type_pattern}\s+([a-zA-Z_]\w*)\s*\((.*?)\)'
-    struct_pattern = r'^\s*struct\s+([a-zA-Z_]\w*)\s*{'
-
     keywords = set(['if', 'else', 'for', 'while', 'do', 'switch', 'case', 'default',
                     'break', 'continue', 'return', 'goto', 'typedef', 'struct', 'enum',
                     'union', 'sizeof', 'volatile', 'register', 'extern', 'inline',
@@ -1589,26 +1801,22 @@ def extract_global_variables(file_path):
 
     def is_in_string(line, pos):
         """Check if the given position in the line is inside a string literal."""
+        # Without any quote before pos there is nothing to walk through
+        if pos >= len(line) or (line.find('"', 0, pos) == -1 and line.find("'", 0, pos) == -1):
+            return False
         in_single_quote = False
         in_double_quote = False
-        escape = False
-        for i, char in enumerate(line):
-            if i >= pos:
-                return in_single_quote or in_double_quote
-            if escape:
-                escape = False
-                continue
-            if char == '\\':
-                escape = True
-            elif char == "'" and not in_double_quote:
+        # Jump from quote to quote (escaped characters are matched, and skipped, as a pair)
+        for quote_match in quote_or_escape_re.finditer(line, 0, pos):
+            char = quote_match.group()
+            if char == "'" and not in_double_quote:
                 in_single_quote = not in_single_quote
             elif char == '"' and not in_single_quote:
                 in_double_quote = not in_double_quote
-        return False
+        return in_single_quote or in_double_quote
 
     try:
-        with open(file_path, 'r') as f:
-            content = f.read()
+        content = read_file_contents(file_path)
 
         lines = content.split('\n')
         scope_stack = []
@@ -1645,7 +1853,7 @@ def extract_global_variables(file_path):
                 continue  # Skip processing this line if we're in a raw string
 
             # Check for control structures
-            first_word = stripped_line.split()[0] if stripped_line else ''
+            first_word = stripped_line.split(None, 1)[0] if stripped_line else ''
             if first_word in control_structures:
                 scope_stack.append('control')
 
@@ -1658,8 +1866,8 @@ def extract_global_variables(file_path):
                     potential_func_start = False
                 continue
 
-            # Check for struct start
-            struct_match = re.search(struct_pattern, stripped_line)
+            # Check for struct start (the literal checks skip the regexes for most lines)
+            struct_match = global_struct_re.search(stripped_line) if 'struct' in stripped_line else None
             if struct_match and not scope_stack:
                 in_struct = True
                 current_struct = struct_match.group(1)
@@ -1667,7 +1875,7 @@ def extract_global_variables(file_path):
                 scope_stack.append('struct')
 
             # Check for function start
-            func_match = re.search(func_pattern, stripped_line)
+            func_match = global_func_re.search(stripped_line) if '(' in stripped_line else None
             if func_match and not scope_stack:
                 if stripped_line.endswith('{'):
                     scope_stack.append('function')
@@ -1680,27 +1888,27 @@ def extract_global_variables(file_path):
                 open_braces = stripped_line.count('{')
                 close_braces = stripped_line.count('}')
                 
-                for _ in range(open_braces):
-                    if not scope_stack or scope_stack[-1] == 'brace':
-                        scope_stack.append('brace')
+                # Push/pop all braces of the line at once instead of one by one
+                if open_braces and (not scope_stack or scope_stack[-1] == 'brace'):
+                    scope_stack.extend(['brace'] * open_braces)
                     
-                for _ in range(close_braces):
-                    if scope_stack and scope_stack[-1] == 'brace':
-                        scope_stack.pop()
-                    elif scope_stack:
-                        scope_stack.pop()
-                        if not scope_stack:
+                if close_braces and scope_stack:
+                    if close_braces >= len(scope_stack):
+                        if scope_stack[0] != 'brace':
                             in_struct = False
                             current_struct = None
+                        scope_stack.clear()
+                    else:
+                        del scope_stack[-close_braces:]
 
             # Check for variable declarations only at global scope
-            if not scope_stack and not stripped_line.startswith('return'):
-                var_match = re.search(var_pattern, stripped_line)
-                class_instance_match = re.search(class_instance_pattern, stripped_line)
+            if not scope_stack and ';' in stripped_line and not stripped_line.startswith('return'):
+                var_match = global_var_re.search(stripped_line)
+                class_instance_match = global_class_instance_re.search(stripped_line)
                 
                 if var_match and not is_in_string(line, var_match.start()):
                     var_type = var_match.group(1).strip()
-                    var_declarations = re.findall(r'([a-zA-Z_]\w*(?:\[.*?\])?)(?:\s*=\s*[^,;]+)?', var_match.group(2))
+                    var_declarations = var_declarator_re.findall(var_match.group(2))
                     for var_name in var_declarations:
                         base_name = var_name.split('[')[0].strip()
                         if base_name.lower() not in keywords and not base_name.isdigit():
@@ -1714,19 +1922,19 @@ def extract_global_variables(file_path):
                                     var_type = var_type + '*'
                             
                             file_vars.append((var_type, var_name, None, is_pointer))
-                            logging.debug(f"\t[1] Global variable found: [{var_type} {var_name}]")
+                            logging.debug("\t[1] Global variable found: [%s %s]", var_type, var_name)
                             if is_pointer:
-                                logging.debug(f"\t\t[1] Pointer variable detected: [{var_type} {var_name}]")
+                                logging.debug("\t\t[1] Pointer variable detected: [%s %s]", var_type, var_name)
                 
                 elif class_instance_match and not is_in_string(line, class_instance_match.start()):
                     var_type = class_instance_match.group(1).strip()
                     var_name = class_instance_match.group(2).strip()
                     if var_name.lower() not in keywords and not var_name.isdigit():
                         file_vars.append((var_type, var_name, None, False))
-                        logging.debug(f"\t[1] Global class instance found: [{var_type} {var_name}]")
+                        logging.debug("\t[1] Global class instance found: [%s %s]", var_type, var_name)
 
-        # Remove duplicate entries
-        unique_file_vars = list(set(file_vars))
+        # Remove duplicate entries (keeping the order in which they were found)
+        unique_file_vars = list(dict.fromkeys(file_vars))
 
         # Add new global variables to the existing ones
         if fbase in global_vars:
@@ -1735,7 +1943,7 @@ def extract_global_variables(file_path):
             global_vars[fbase] = unique_file_vars
 
         if unique_file_vars:
-            logging.info(f"\t[1] Processed {os.path.basename(file_path)} successfully. Found {len(unique_file_vars)} new global variables.")
+            logging.info(f"\t[1] Processed {file} successfully. Found {len(unique_file_vars)} new global variables.")
 
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -1757,55 +1965,40 @@ def extract_constant_pointers(file_path):
     Extract constant pointer array definitions with initializers from a single .ino, .cpp, or header file.
     Only variables declared outside of all function blocks are considered.
     """
+    # Get the file name and the fbase (filename without extension) once
+    file = os.path.basename(file_path)
+    fbase = os.path.splitext(file)[0]
+
     logging.info("")
-    logging.info(f"Processing: extract_constant_pointers() from : {os.path.basename(file_path)}")
+    logging.info(f"Processing: extract_constant_pointers() from : {file}")
 
     try:
         global_vars = {}
 
-        # Get the fbase (filename without extension)
-        file = os.path.basename(file_path)
-        fbase = os.path.splitext(file)[0]
-
         # Check if there are existing entries in dict_global_variables for this fbase
         if fbase in dict_global_variables:
             global_vars[fbase] = dict_global_variables[fbase]
             logging.info(f"\t[2] Found {len(global_vars[fbase])} existing global variables for {fbase} in dict_global_variables")
 
-        # Comprehensive list of object types, including String and dict_known_classes
-        basic_types = r'uint8_t|int8_t|uint16_t|int16_t|uint32_t|int32_t|uint64_t|int64_t|char|int|float|double|bool|boolean|long|short|unsigned|signed|size_t|void|String|time_t|struct tm'
-
-        # Regular expression to match const char* or const int* declarations
-        pattern = rf'const\s+({basic_types})\s*\*\s*(\w+)\s*\[\]\s*{{' + r'\s*("[^"]*"\s*,\s*)*("[^"]*"\s*)\s*}|const\s+int\s*\*\s*(\w+)\s*{\s*\d+\s*(\s*,\s*\d+)*\s*};'
-        
         file_vars = []
 
-        with open(file_path, 'r') as file:
-            content = file.read()
+        content = read_file_contents(file_path)
 
         # Remove comments
-        content = re.sub(r'//.*?\n|/\*.*?\*/', '', content, flags=re.DOTALL)
+        content = strip_comments(content)
 
-        # Split content by semicolon to handle each declaration separately
-        declarations = content.split(';')
-        
-        for declaration in declarations:
-            # Remove leading and trailing whitespace and check if it's not empty
-            declaration = declaration.strip()
-            if not declaration:
-                continue
-            match = re.match(pattern, declaration)
-            if match:
-                var_type = f"const {match.group(1)}*"
-                var_name = match.group(2) or match.group(5)  # Group 2 for array, group 5 for single pointer
-                current_function = None
-                is_pointer = True
-                var_full_name = var_name +"[]"
-                file_vars.append((var_type, var_full_name, current_function, is_pointer))
-                logging.info(f"\t[2] Constant pointer found: [{var_type} {var_full_name}]")
+        # Scan the whole content at once instead of splitting it into declarations first
+        for match in constant_pointer_re.finditer(content):
+            var_type = f"const {match.group(1)}*"
+            var_name = match.group(2)
+            current_function = None
+            is_pointer = True
+            var_full_name = var_name +"[]"
+            file_vars.append((var_type, var_full_name, current_function, is_pointer))
+            logging.info(f"\t[2] Constant pointer found: [{var_type} {var_full_name}]")
 
-        # Remove duplicate entries
-        unique_file_vars = list(set(file_vars))
+        # Remove duplicate entries (keeping the order in which they were found)
+        unique_file_vars = list(dict.fromkeys(file_vars))
 
         # Add new global variables to the existing ones
         if fbase in global_vars:
@@ -1814,7 +2007,7 @@ def extract_constant_pointers(file_path):
             global_vars[fbase] = unique_file_vars
 
         if unique_file_vars:
-            logging.info(f"\t[2] Processed {os.path.basename(file_path)} successfully. Found {len(unique_file_vars)} new constant pointers.")
+            logging.info(f"\t[2] Processed {file} successfully. Found {len(unique_file_vars)} new constant pointers.")
 
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -1855,24 +2048,45 @@ def extract_undefined_vars_in_file(file_path):
             content = file.read()
         
         # Remove comments
-        content = re.sub(r'//.*?\n|/\*.*?\*/', '', content, flags=re.DOTALL)
+        content = strip_comments(content)
 
         undefined_vars = {}
         
         current_file_basename = os.path.splitext(os.path.basename(file_path))[0]
+
+        # Offsets at which the lines start, to look up line numbers with a binary search
+        line_starts = [0]
+        line_starts.extend(m.end() for m in newline_re.finditer(content))
         
         # Find all variable declarations in the file
-        declarations = re.findall(r'\b(?:const\s+)?(?:unsigned\s+)?(?:static\s+)?(?:volatile\s+)?\w+\s+([a-zA-Z_]\w*)(?:\s*=|\s*;|\s*\[)', content)
-        declared_vars = {var for var in declarations if var not in KEYWORDS_AND_TYPES and not var.isdigit()}
-        logging.debug(f"Variables declared in file: {declared_vars}")
+        # (the matches are filtered straight into sets, without building intermediate lists)
+        declared_vars = {var for var in map(itemgetter(1), var_declaration_re.finditer(content))
+                         if var not in KEYWORDS_AND_TYPES and not var.isdigit()}
+        logging.debug("Variables declared in file: %s", declared_vars)
         
         # Find all variables used in the file
-        used_vars = re.findall(r'\b([a-zA-Z_]\w*)\b', content)
-        used_vars = [var for var in used_vars if var not in KEYWORDS_AND_TYPES and not var.isdigit()]
-        logging.debug(f"Variables used in file: {set(used_vars)}")
+        used_vars = {var for var in map(itemgetter(1), identifier_re.finditer(content))
+                     if var not in KEYWORDS_AND_TYPES and not var.isdigit()}
+        logging.debug("Variables used in file: %s", used_vars)
         
+        # Index dict_global_variables once by name (arrays also by their bare name),
+        # instead of scanning all global variables for every used variable.
+        # Just like the nested scan did, the first file that defines a name wins and
+        # within that file the last definition of the name wins.
+        global_var_index = {}
+        for defined_file, file_vars in dict_global_variables.items():
+            defined_file_basename = os.path.splitext(os.path.basename(defined_file))[0]
+            file_var_index = {}
+            for v_type, v_name, is_pointer, _ in file_vars:
+                var_info = (v_type, v_name, is_pointer, defined_file_basename)
+                file_var_index[v_name] = var_info
+                if '[' in v_name:
+                    file_var_index[v_name.split('[', 1)[0]] = var_info
+            for name, var_info in file_var_index.items():
+                global_var_index.setdefault(name, var_info)
+
         # Identify potentially undefined variables
-        for var in set(used_vars) - declared_vars:
+        for var in used_vars - declared_vars:
             # Check if the variable is in dict_global_variables
             var_found = False
             var_type = 'Unknown'
@@ -1880,28 +2094,21 @@ def extract_undefined_vars_in_file(file_path):
             global_var_name = var
             v_is_pointer = False
             
-            for defined_file, file_vars in dict_global_variables.items():
-                defined_file_basename = os.path.splitext(os.path.basename(defined_file))[0]
-                for v_type, v_name, is_pointer, _ in file_vars:
-                    if v_name == var or (not '[' in var and re.match(rf'^{re.escape(var)}\[', v_name)):
-                        var_found = True
-                        var_type = v_type
-                        defined_in = defined_file_basename
-                        global_var_name = v_name  # Store the name as found in dict_global_variables
-                        v_is_pointer = is_pointer
-                        if defined_file_basename == current_file_basename:
-                            # Variable is defined in the same file, so it's not undefined
-                            if args.debug:
-                                logging.info(f"Variable {var} found in global variables of the same file")
-                            break
-                if var_found:
-                    break
+            var_info = global_var_index.get(var)
+            if var_info is not None:
+                var_found = True
+                # Store the name as found in dict_global_variables
+                var_type, global_var_name, v_is_pointer, defined_in = var_info
+                if defined_in == current_file_basename:
+                    # Variable is defined in the same file, so it's not undefined
+                    if args.debug:
+                        logging.info(f"Variable {var} found in global variables of the same file")
             
             if var_found and defined_in != current_file_basename and var_type != 'Unknown':
                 # Find the first occurrence of the variable in the file
                 match = re.search(r'\b' + re.escape(var) + r'\b', content)
                 if match:
-                    line_number = content[:match.start()].count('\n') + 1
+                    line_number = bisect_right(line_starts, match.start())
                     key = f"{global_var_name}+{current_file_basename}"
                     undefined_vars[key] = {
                         'var_type': var_type,
@@ -1911,12 +2118,12 @@ def extract_undefined_vars_in_file(file_path):
                         'defined_in': defined_in,
                         'line': line_number
                     }
-                    logging.debug(f"Added usage of {global_var_name} to undefined_vars: {undefined_vars[key]}")
+                    logging.debug("Added usage of %s to undefined_vars: %s", global_var_name, undefined_vars[key])
 
             elif not var_found or var_type == 'Unknown':
-                logging.debug(f"Variable {var} not found in dict_global_variables or has unknown type, skipping")
+                logging.debug("Variable %s not found in dict_global_variables or has unknown type, skipping", var)
     
-        logging.debug(f"Final undefined_vars: {undefined_vars}")
+        logging.debug("Final undefined_vars: %s", undefined_vars)
         
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -1941,47 +2148,42 @@ def extract_prototypes(file_path):
     logging.info(f"Processing: extract_prototypes() from file: [{os.path.basename(file_path)}]")
     
     prototypes = {}
+    file_name = os.path.basename(file_path)
+    is_ino_file = file_path.lower().endswith('.ino')
     
-    # Regex pattern for function header
-    pattern = r'^\s*(?:static\s+|inline\s+|virtual\s+|explicit\s+|constexpr\s+)*' \
-              r'(?:const\s+)?' \
-              r'(?:\w+(?:::\w+)*\s+)+' \
-              r'[\*&]?\s*' \
-              r'(\w+)\s*\(((?:[^()]|\([^()]*\))*)\)\s*{'
-
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
+        content = read_file_contents(file_path)
         
-        # Remove comments and string literals
-        content = re.sub(r'//.*?$|/\*.*?\*/|\'(?:\\.|[^\\\'])*\'|"(?:\\.|[^\\"])*"', '', content, flags=re.DOTALL | re.MULTILINE)
-        
-        matches = re.finditer(pattern, content, re.MULTILINE)
+        # Without a '{' there are no function bodies: skip stripping the comments and string literals
+        if '{' in content:
+            matches = prototype_re.finditer(comment_and_literal_re.sub('', content))
+        else:
+            matches = ()
         
         for match in matches:
             func_name = match.group(1)
             params = match.group(2)
             
             # Skip if the function name starts with "if", "else", "for", "while", etc.
-            if func_name.lower() in ['if', 'else', 'for', 'while', 'switch', 'case']:
+            if func_name.lower() in control_keywords:
                 continue
             
             # Skip "setup" and "loop" functions in .ino files
-            if file_path.lower().endswith('.ino') and func_name in ['setup', 'loop']:
+            if is_ino_file and func_name in ('setup', 'loop'):
                 continue
             
             # Reconstruct the prototype
             prototype = match.group(0).strip()[:-1]  # remove the opening brace
-            prototype = ' '.join(prototype.split())  # normalize whitespace
+            prototype = whitespace_re.sub(' ', prototype).strip()  # normalize whitespace
             
             # Use (func_name, params) as the key
             key = (func_name, params.strip())
-            prototypes[key] = (prototype, os.path.basename(file_path), func_name)
+            prototypes[key] = (prototype, file_name, func_name)
             
-            logging.debug(f"\tExtracted prototype [{prototype}]")
+            logging.debug("\tExtracted prototype [%s]", prototype)
         
         if not prototypes:
-            logging.debug(f"\tNo function prototypes found in {os.path.basename(file_path)}")
+            logging.debug(f"\tNo function prototypes found in {file_name}")
     
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -2091,31 +2293,53 @@ def extract_class_instances(file_path):
     return class_instances
 
 #------------------------------------------------------------------------------------------------------
-def update_arduinoglue_with_includes(dict_all_includes):
+def update_arduinoglue(dict_all_includes, dict_global_variables, dict_prototypes):
+    """
+    Add the includes, global variables and prototypes to arduinoGlue.h.
+    The file is read and written only once for the three updates.
+    """
+    try:
+        glue_path = glob_pio_arduinoGlue
+        with open(glue_path, "r") as file:
+            content = file.read()
+
+        content = update_arduinoglue_with_includes(content, dict_all_includes)
+        content = update_arduinoglue_with_global_variables(content, dict_global_variables)
+        content = update_arduinoglue_with_prototypes(content, dict_prototypes)
+
+        write_file(glue_path, content)
+
+    except Exception as e:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        line_number = exc_tb.tb_lineno
+        logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
+        exit()
+
+#------------------------------------------------------------------------------------------------------
+def update_arduinoglue_with_includes(content, dict_all_includes):
+    """Insert the includes into the arduinoGlue.h content; returns the updated content."""
     logging.info("")
     logging.info("Processing: update_arduinoglue_with_includes()")
 
     global all_includes_added
 
     try:
-        glue_path = os.path.join(glob_pio_include, "arduinoGlue.h")
-        with open(glue_path, "r") as file:
-            content = file.read()
-
         insert_pos = find_marker_position(content, all_includes_marker)
         
-        new_content = content[:insert_pos] # + "\n"
+        # Collect the pieces in a list and join them once
+        new_content = [content[:insert_pos]] # + "\n"
 
+        # Only format the per-line debug messages if they are logged
+        log_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
         for include in dict_all_includes:
-            logging.debug(f"Added:\t{include}")
-            new_content += f"{include}\n"
+            if log_debug:
+                logging.debug(f"Added:\t{include}")
+            new_content.append(f"{include}\n")
             all_includes_added = True
-        new_content += "\n"
+        new_content.append("\n")
 
-        new_content += content[insert_pos:]
-
-        with open(glue_path, "w") as file:
-            file.write(new_content)
+        new_content.append(content[insert_pos:])
+        new_content = ''.join(new_content)
 
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -2123,39 +2347,41 @@ def update_arduinoglue_with_includes(dict_all_includes):
         logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
         exit()
 
+    return new_content
+
 #------------------------------------------------------------------------------------------------------
-def update_arduinoglue_with_global_variables(dict_global_variables):
+def update_arduinoglue_with_global_variables(content, dict_global_variables):
+    """Insert the extern declarations of the global variables into the arduinoGlue.h content; returns the updated content."""
     logging.info("")
     logging.info("Processing: update_arduinoglue_with_global_variables()")
 
     global extern_variables_added
 
     try:
-        glue_path = os.path.join(glob_pio_include, "arduinoGlue.h")
-        with open(glue_path, "r") as file:
-            content = file.read()
-
         insert_pos = find_marker_position(content, extern_variables_marker)
         
-        new_content = content[:insert_pos] # + "\n"
+        # Collect the pieces in a list and join them once
+        new_content = [content[:insert_pos]] # + "\n"
 
+        # Only format the per-variable debug messages if they are logged
+        log_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
         sorted_global_vars = sort_global_vars(dict_global_variables)
         for file_path, vars_list in sorted_global_vars.items():
             if vars_list:  # Only print for files that have global variables
                 for var_type, var_name, function, is_pointer in vars_list:
                     var_name += ';'
                     if var_type.startswith("static "):
-                        logging.debug(f"\t\t\tFound static variable [{var_type}] (remove \'static\' part)")
+                        if log_debug:
+                            logging.debug(f"\t\t\tFound static variable [{var_type}] (remove \'static\' part)")
                         var_type = var_type.replace("static ", "").strip()  # Remove 'static' and any leading/trailing spaces
-                    logging.debug(f"Added:\textern {var_type:<15} {var_name:<35}\t\t//-- from {file_path})")
-                    new_content += (f"extern {var_type:<15} {var_name:<35}\t\t//-- from {file_path}\n")
+                    if log_debug:
+                        logging.debug(f"Added:\textern {var_type:<15} {var_name:<35}\t\t//-- from {file_path})")
+                    new_content.append(f"extern {var_type:<15} {var_name:<35}\t\t//-- from {file_path}\n")
                     extern_variables_added = True
-        new_content += "\n"
-
-        new_content += content[insert_pos:]
+        new_content.append("\n")
 
-        with open(glue_path, "w") as file:
-            file.write(new_content)
+        new_content.append(content[insert_pos:])
+        new_content = ''.join(new_content)
 
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -2163,40 +2389,42 @@ def update_arduinoglue_with_global_variables(dict_global_variables):
         logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
         exit()
 
+    return new_content
+
 #------------------------------------------------------------------------------------------------------
-def update_arduinoglue_with_prototypes(dict_prototypes):
+def update_arduinoglue_with_prototypes(content, dict_prototypes):
+    """Insert the function prototypes into the arduinoGlue.h content; returns the updated content."""
     logging.info("")
     logging.info("Processing: update_arduinoglue_with_prototypes()")
 
     global prototypes_added
 
     try:
-        glue_path = os.path.join(glob_pio_include, "arduinoGlue.h")
-        with open(glue_path, "r") as file:
-            content = file.read()
-
         insert_pos = find_marker_position(content, prototypes_marker)
         
-        new_content = content[:insert_pos] # + "\n"
+        # Collect the pieces in a list and join them once
+        new_content = [content[:insert_pos]] # + "\n"
 
+        # Only format the per-prototype debug messages if they are logged
+        log_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
         sav_file = ""
         for key, value in dict_prototypes.items():
             func_name, params = key
             prototype, file_name, bare_func_name = value
             if sav_file != file_name:
                 sav_file = file_name
-                logging.debug(f"Added:\t//-- from {file_name} ----------")
-                new_content += (f"//-- from {file_name} -----------\n")
+                if log_debug:
+                    logging.debug(f"Added:\t//-- from {file_name} ----------")
+                new_content.append(f"//-- from {file_name} -----------\n")
                 prototypes_added = True
             prototype_sm = prototype + ';'
-            logging.debug(f"Added:\t{prototype_sm}")
-            new_content += (f"{prototype_sm:<60}\n")
-        new_content += "\n"
+            if log_debug:
+                logging.debug(f"Added:\t{prototype_sm}")
+            new_content.append(f"{prototype_sm:<60}\n")
+        new_content.append("\n")
 
-        new_content += content[insert_pos:]
-
-        with open(glue_path, "w") as file:
-            file.write(new_content)
+        new_content.append(content[insert_pos:])
+        new_content = ''.join(new_content)
 
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -2204,10 +2432,12 @@ def update_arduinoglue_with_prototypes(dict_prototypes):
         logging.error(f"\tAn error occurred at line {line_number}: {str(e)}")
         exit()
 
+    return new_content
+
 #------------------------------------------------------------------------------------------------------
 def remove_unused_markers_from_arduinoGlue():
     logging.info("Processing: remove_unused_markers_from_arduinoGlue()")
-    glue_path = os.path.join(glob_pio_include, "arduinoGlue.h")
+    glue_path = glob_pio_arduinoGlue
     logging.info(f"GluePath: {glue_path}")
 
     try:
@@ -2229,26 +2459,27 @@ def remove_unused_markers_from_arduinoGlue():
             convertor_marker: 'convertor_added'
         }
 
-        # Create a list of all markers for the regex pattern
-        all_markers = '|'.join(re.escape(m) for m in markers.keys())
+        unused_markers = {marker for marker, test_var in markers.items() if not globals().get(test_var, False)}
+        removed_sections = {marker: 0 for marker in unused_markers}
 
-        for marker, test_var in markers.items():
+        def remove_unused_section(match):
+            marker = match.group(1)
+            if marker in unused_markers:
+                removed_sections[marker] += 1
+                return ''
+            return match.group(0)
+
+        # Remove the sections (from a marker to the next marker or #endif) of all unused markers in one pass
+        content = marker_section_re.sub(remove_unused_section, content)
+
+        for marker in markers:
             logging.debug(f"\tChecking marker: {marker}")
-            if not globals().get(test_var, False):
+            if marker in unused_markers:
                 logging.info(f"\tRemoving unused marker: {marker}")
-                # Pattern to match from this marker to the next marker or #endif
-                pattern = f'({re.escape(marker)}).*?(?={all_markers}|#endif)'
-                #debug#logging.info(f"\tSearch pattern: {pattern}")
-                matches = re.findall(pattern, content, flags=re.DOTALL)
-                if matches:
-                    for match in matches:
-                        logging.debug(f"\tFound match: {match}")
-                    new_content = re.sub(pattern, '', content, flags=re.DOTALL)
-                    if new_content != content:
-                        logging.debug(f"\tMarker {marker} successfully removed")
-                        content = new_content
-                    else:
-                        logging.info(f"\tNo change for marker {marker} despite matches")
+                if removed_sections[marker]:
+                    for _ in range(removed_sections[marker]):
+                        logging.debug(f"\tFound match: {marker}")
+                    logging.debug(f"\tMarker {marker} successfully removed")
                 else:
                     logging.info(f"\tNo matches found for marker {marker}")
 
@@ -2257,8 +2488,7 @@ def remove_unused_markers_from_arduinoGlue():
             content += '\n#endif // ARDUINOGLUE_H\n'
 
         if content != original_content:
-            with open(glue_path, 'w') as file:
-                file.write(content)
+            write_file(glue_path, content)
             logging.info("File updated 'arduinoGlue.h'successfully")
         else:
             logging.info("No changes were necessary for 'arduinoGlue.h'")
@@ -2297,15 +2527,16 @@ def insert_class_instances_to_header_files(file_name):
         with open(header_file, 'r') as f:
             header_content = f.read()
 
-        # Get the class instances for this file
-        file_instances = []
-        for file_path, instances in dict_class_instances.items():
-            if os.path.split(os.path.basename(file_path))[0] == os.path.split(os.path.basename(header_file))[0]:
-                file_instances = instances
-                break
+        # Get the class instances for this file (the source file with the same basename as the header)
+        header_stem = os.path.splitext(header_base)[0]
+        file_instances = next((instances for file_path, instances in dict_class_instances.items()
+                               if os.path.splitext(os.path.basename(file_path))[0] == header_stem), [])
         
         logging.info(f"\t\t>> Found {len(file_instances)} class instances for [{file_base}]")
 
+        # Collect the libraries that are already included once, instead of searching per class
+        existing_includes = set(map(itemgetter(1), library_include_name_re.finditer(header_content)))
+
         # Process regular class instances and singleton includes
         includes_to_add = set()
         for instance in file_instances:
@@ -2313,30 +2544,23 @@ def insert_class_instances_to_header_files(file_name):
             logging.info(f"\t\tChecking if {class_name} ...")
             # Check if it's a singleton include (ends with .h)
             if class_name.endswith('.h'):
-                include_pattern = rf'#include\s*<{re.escape(class_name)}>\s*(//.*)?$'
-                if not re.search(include_pattern, header_content, re.MULTILINE):
+                if class_name not in existing_includes:
                     includes_to_add.add(f'#include <{class_name}>\t\t//== singleton')
                     logging.info(f"\t\tAdding: #include <{class_name}>\t\t//== singleton")
                 else:
                     logging.info(f"\t\tSkipping (already exists): #include <{class_name}>")
             else:
                 # Check if the class is in dict_singleton_classes
-                singleton_header = None
-                for header, classes in dict_singleton_classes.items():
-                    if class_name in classes:
-                        singleton_header = header
-                        break
+                singleton_header = dict_singleton_headers.get(class_name)
                 
                 if singleton_header:
-                    include_pattern = rf'#include\s*<{re.escape(singleton_header)}>\s*(//.*)?$'
-                    if not re.search(include_pattern, header_content, re.MULTILINE):
+                    if singleton_header not in existing_includes:
                         includes_to_add.add(f'#include <{singleton_header}>\t\t//-- singleton')
                         logging.info(f"\t\tAdding: #include <{singleton_header}>\t\t//-- singleton")
                     else:
                         logging.info(f"\t\tSkipping (already exists): #include <{singleton_header}>")
                 else:
-                    include_pattern = rf'#include\s*<{re.escape(class_name)}\.h>\s*(//.*)?$'
-                    if not re.search(include_pattern, header_content, re.MULTILINE):
+                    if f"{class_name}.h" not in existing_includes:
                         includes_to_add.add(f'#include <{class_name}.h>\t\t//-- class')
                         logging.info(f"\t\tAdding: #include <{class_name}.h>\t\t//-- class")
                     else:
@@ -2359,8 +2583,7 @@ def insert_class_instances_to_header_files(file_name):
             logging.warning(f"\t\tCould not find marker {all_includes_marker} in {short_path(header_file)}")
 
         # Write the updated content back to the .h file
-        with open(header_file, 'w') as f:
-            f.write(updated_content)
+        write_file(header_file, updated_content)
 
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -2382,47 +2605,62 @@ def update_header_with_prototypes(header_path, prototypes):
     else:
         short_header_path = header_path
 
-    with open(header_path, 'r+') as f:
+    with open(header_path, 'r') as f:
         content = f.read()
 
-        # Search for the prototype insertion marker
-        insert_start = content.find(f"{prototypes_marker}")
-        if insert_start != -1:
-            insert_pos = insert_start + len(f"{prototypes_marker}\n")
-        else:
-            insert_start = -1
+    # Search for the prototype insertion marker
+    insert_start = content.find(f"{prototypes_marker}")
+    if insert_start != -1:
+        insert_pos = insert_start + len(f"{prototypes_marker}\n")
+    else:
+        insert_start = -1
 
-        # If marker is not found, search for the last #include statement
-        if insert_start == -1:
-            include_matches = list(re.finditer(r'#include\s*<[^>]+>', content))
-            if include_matches:
-                insert_pos = include_matches[-1].end() + 1  # Position after the last #include
-            else:
-                # If no #include statement, search for header guard
-                header_guard_match = re.search(r'#ifndef\s+\w+\s+#define\s+\w+', content, re.MULTILINE)
-                if header_guard_match:
-                    insert_pos = header_guard_match.end() + 1  # Position after the header guard
-                else:
-                    # If no header guard, insert at the top of the file
-                    insert_pos = 0
-
-        # Gather existing prototypes to avoid duplication
-        existing_prototypes = set(re.findall(r'^[^\S\r\n]*(?:extern\s+)?\w[\w\s\*\(\),]*\s*\([^;]*\);', content[insert_pos:], re.MULTILINE))
-        prototypes_to_add = set(prototypes) - existing_prototypes
-
-        if prototypes_to_add:
-            new_content = (content[:insert_pos] +
-                           '\n'.join(sorted(prototypes_to_add)) + '\n\n' +
-                           content[insert_pos:])
-            f.seek(0)
-            f.write(new_content)
-            f.truncate()
-            logging.info(f"\tAdded {len(prototypes_to_add)} function prototypes to [{os.path.basename(header_path)}]")
-            for prototype in prototypes_to_add:
-                logging.info(f"  - {prototype}")
+    # If marker is not found, search for the last #include statement
+    if insert_start == -1:
+        include_matches = list(angle_include_re.finditer(content))
+        if include_matches:
+            insert_pos = include_matches[-1].end() + 1  # Position after the last #include
         else:
-            logging.info(f"\tNo new function prototypes added to [{os.path.basename(header_path)}]")
+            # If no #include statement, search for header guard
+            header_guard_match = header_guard_block_re.search(content)
+            if header_guard_match:
+                insert_pos = header_guard_match.end() + 1  # Position after the header guard
+            else:
+                # If no header guard, insert at the top of the file
+                insert_pos = 0
+
+    # Gather existing prototypes to avoid duplication; the prototypes are compared
+    # with normalized whitespace, so a different layout doesn't add a duplicate
+    new_prototypes = {' '.join(prototype.split()): prototype for prototype in prototypes}
+    header_tail = content[insert_pos:]
+    if '(' in header_tail:
+        for prototype in existing_prototype_re.findall(header_tail):
+            new_prototypes.pop(' '.join(prototype.split()), None)
+    prototypes_to_add = set(new_prototypes.values())
+
+    if prototypes_to_add:
+        # Write the pieces one after the other instead of building the new content first
+        write_file(header_path, [content[:insert_pos], '\n'.join(sorted(prototypes_to_add)), '\n\n', header_tail])
+        logging.info(f"\tAdded {len(prototypes_to_add)} function prototypes to [{os.path.basename(header_path)}]")
+        for prototype in prototypes_to_add:
+            logging.info(f"  - {prototype}")
+    else:
+        logging.info(f"\tNo new function prototypes added to [{os.path.basename(header_path)}]")
+
 
+#------------------------------------------------------------------------------------------------------
+def get_source_functions(file_path):
+    """
+    Return the names of the functions called in a source file and of the functions defined in it (two sets).
+    Every source file is only read and scanned once; the sets are shared by all callers, so they are frozen.
+    """
+    source_functions = dict_source_functions.get(file_path)
+    if source_functions is None:
+        with open(file_path, 'r') as f:
+            content = f.read()
+        source_functions = (frozenset(function_call_re.findall(content)), frozenset(local_function_re.findall(content)))
+        dict_source_functions[file_path] = source_functions
+    return source_functions
 
 #------------------------------------------------------------------------------------------------------
 def find_undefined_functions_and_update_headers(glob_pio_src, glob_pio_include, function_reference_array):
@@ -2434,9 +2672,11 @@ def find_undefined_functions_and_update_headers(glob_pio_src, glob_pio_include,
     logging.info()
     logging.info("Processing: find_undefined_functions_and_update_headers")
 
-    for file in os.listdir(glob_pio_src):
+    with os.scandir(glob_pio_src) as entries:
+        source_entries = [(entry.name, entry.path) for entry in entries]
+
+    for file, file_path in source_entries:
         if file.endswith('.cpp'):
-            file_path = os.path.join(glob_pio_src, file)
             base_name = os.path.splitext(file)[0]
             header_path = os.path.join(glob_pio_include, f"{base_name}.h")
 
@@ -2446,14 +2686,8 @@ def find_undefined_functions_and_update_headers(glob_pio_src, glob_pio_include,
             else:
                 short_header_path = header_path
 
-            with open(file_path, 'r') as f:
-                content = f.read()
-
-            # Find all function calls
-            function_calls = set(re.findall(r'\b(\w+)\s*\(', content))
-
-            # Find local function definitions
-            local_functions = set(re.findall(r'\b\w+[\s\*]+(\w+)\s*\([^)]*\)\s*{', content))
+            # Find all function calls and local function definitions
+            function_calls, local_functions = get_source_functions(file_path)
 
             # Determine which functions are undefined in this file
             undefined_functions = function_calls - local_functions
@@ -2491,7 +2725,7 @@ def find_undefined_functions_and_update_headers(glob_pio_src, glob_pio_include,
                             insert_pos = header_content.find(f"{marker}")
                             if insert_pos == -1:
                                 marker = ""
-                                header_guard_end = re.search(r'#define\s+\w+_H\s*\n', header_content)
+                                header_guard_end = header_guard_define_re.search(header_content)
                                 if header_guard_end:
                                     insert_pos = header_guard_end.end()
                                 else:
@@ -2506,8 +2740,7 @@ def find_undefined_functions_and_update_headers(glob_pio_src, glob_pio_include,
                     )
 
                     # Write the updated content back to the header file
-                    with open(header_path, 'w') as f:
-                        f.write(updated_content)
+                    write_file(header_path, updated_content)
 
                     logging.info(f"\tUpdated {short_header_path} with new includes:")
                     for include in new_includes:
@@ -2529,13 +2762,14 @@ def process_function_references(glob_pio_src, glob_pio_include):
     function_reference_array = {}
 
     # Collect all function prototypes from header files
-    for file in os.listdir(glob_pio_include):
-        if file.endswith('.h'):
-            with open(os.path.join(glob_pio_include, file), 'r') as f:
-                content = f.read()
-            prototypes = re.findall(r'^\w+[\s\*]+(\w+)\s*\([^)]*\);', content, re.MULTILINE)
-            for func_name in prototypes:
-                function_reference_array[func_name] = file
+    with os.scandir(glob_pio_include) as entries:
+        header_entries = [(entry.name, entry.path) for entry in entries if entry.name.endswith('.h')]
+    for file, header_file_path in header_entries:
+        with open(header_file_path, 'r') as f:
+            content = f.read()
+        prototypes = header_prototype_re.findall(content)
+        for func_name in prototypes:
+            function_reference_array[func_name] = file
 
     # Print the function reference array
     logging.info("\tFunction Reference Array:")
@@ -2543,33 +2777,27 @@ def process_function_references(glob_pio_src, glob_pio_include):
         logging.info(f"{func}: {file}")
 
     # Process .ino files
-    for file in os.listdir(glob_pio_src):
-        if file.endswith('.ino') or file.endswith('.cpp'):
-            base_name = os.path.splitext(file)[0]
-            source_path = os.path.join(glob_pio_src, file)
-            header_path = os.path.join(glob_pio_include, f"{base_name}.h")
-
-            with open(source_path, 'r') as f:
-                content = f.read()
+    with os.scandir(glob_pio_src) as entries:
+        source_entries = [(entry.name, entry.path) for entry in entries if entry.name.endswith(('.ino', '.cpp'))]
+    for file, source_path in source_entries:
+        base_name = os.path.splitext(file)[0]
+        header_path = os.path.join(glob_pio_include, f"{base_name}.h")
 
-            # Find all function calls
-            function_calls = set(re.findall(r'\b(\w+)\s*\(', content))
+        # Find all function calls and local function definitions (shared with find_undefined_functions_and_update_headers())
+        function_calls, local_functions = get_source_functions(source_path)
 
-            # Find local function definitions
-            local_functions = set(re.findall(r'\b\w+[\s\*]+(\w+)\s*\([^)]*\)\s*{', content))
+        # Determine which functions need to be included
+        functions_to_include = function_calls - local_functions
 
-            # Determine which functions need to be included
-            functions_to_include = function_calls - local_functions
+        headers_to_include = set()
+        for func in functions_to_include:
+            if func in function_reference_array:
+                headers_to_include.add(function_reference_array[func])
+                insert_include_in_header(header_path, function_reference_array[func])
 
-            headers_to_include = set()
-            for func in functions_to_include:
-                if func in function_reference_array:
-                    headers_to_include.add(function_reference_array[func])
-                    insert_include_in_header(header_path, function_reference_array[func])
-
-            # Update the header file with necessary includes
-            #aaw#if headers_to_include:
-                #aaw#insert_include_in_header(header_path, function_reference_array[func])
+        # Update the header file with necessary includes
+        #aaw#if headers_to_include:
+            #aaw#insert_include_in_header(header_path, function_reference_array[func])
 
     logging.info("\tProcessed function references and updated header files")
     return function_reference_array  # Return the function_reference_array
@@ -2580,52 +2808,55 @@ def add_guards_and_marker_to_header(file_path):
     logging.info("")
     logging.info(f"Processing: add_guards_and_marker_to_header() file: [{os.path.basename(file_path)}]")
     
-    with open(file_path, 'r') as file:
-        content = file.read()
+    content = read_file_contents(file_path)
     
     # Replace multiple empty lines with a single empty line
-    content = re.sub(r'\n\s*\n', '\n\n', content)
+    content = empty_lines_re.sub('\n\n', content)
     
+    # Work on the content as it is written back: with '\n' between the lines and no trailing newline
     lines = content.splitlines()
+    content = "\n".join(lines)
     
     # Check for existing header guard
-    has_header_guard = False
-    if len(lines) >= 2 and lines[0].strip().startswith("#ifndef") and lines[1].strip().startswith("#define"):
-        has_header_guard = True
+    has_header_guard = guard_lines_re.match(content) is not None
+    if has_header_guard:
         logging.info("\tHeader guard already present.")
     
     # Add header guard if not present
     if not has_header_guard:
         guard_name = f"{os.path.basename(file_path).upper().replace('.', '_')}_"
-        lines.insert(0, f"#ifndef {guard_name}")
-        lines.insert(1, f"#define {guard_name}")
-        lines.append(f"#endif // {guard_name}")
+        content = (f"#ifndef {guard_name}\n#define {guard_name}\n" + content +
+                   ("\n" if lines else "") + f"#endif // {guard_name}")
         logging.info("\tAdded header guard.")
     
     # Find the last #include statement
-    last_include_index = -1
-    for i, line in enumerate(lines):
-        if line.strip().startswith("#include"):
-            last_include_index = i
+    last_include = None
+    for last_include in include_directive_line_re.finditer(content):
+        pass
     
-    # Determine where to insert the CONVERTOR marker
-    if last_include_index != -1:
-        insert_index = last_include_index + 1
+    # Determine where to insert the CONVERTOR marker: the start of the line after the
+    # last #include, or of the line after the header guard (or the top of the file)
+    if last_include:
+        line_end = content.find('\n', last_include.end())
+        insert_index = content.count('\n', 0, last_include.start()) + 1
         logging.info(f"\tInserting marker after last #include statement (line {insert_index + 1})")
     else:
         # If no #include, insert after header guard or at the beginning
+        line_end = content.find('\n', content.find('\n') + 1) if has_header_guard else -1
         insert_index = 2 if has_header_guard else 0
         logging.info(f"\tInserting marker at the beginning of the file (line {insert_index + 1})")
     
-    # Insert the CONVERTOR marker
-    lines.insert(insert_index, "")
-    lines.insert(insert_index + 1, convertor_marker)
-    lines.insert(insert_index + 2, "")
-
-    modified_content = "\n".join(lines)
+    # Insert the CONVERTOR marker (surrounded by empty lines)
+    if insert_index == 0:
+        modified_content = f"\n{convertor_marker}\n\n" + content
+    elif line_end == -1:
+        # After the last line
+        modified_content = content + f"\n\n{convertor_marker}\n"
+    else:
+        insert_pos = line_end + 1
+        modified_content = content[:insert_pos] + f"\n{convertor_marker}\n\n" + content[insert_pos:]
 
-    with open(file_path, 'w') as file:
-        file.write(modified_content)
+    write_file_contents(file_path, modified_content)
     
     logging.info(f"\tFile {os.path.basename(file_path)} has been successfully modified.")
 
@@ -2643,8 +2874,8 @@ def insert_header_include_in_cpp(file_path):
     basename = os.path.splitext(os.path.basename(file_path))[0]
     include_statement = f'#include "{basename}.h"'
     
-    # Check if the include statement already exists
-    if any(line.strip() == include_statement for line in lines):
+    # Check if the include statement already exists (only look for its line if it is in the file at all)
+    if include_statement in content and any(line.strip() == include_statement for line in lines):
         logging.info(f"\tInclude statement '{include_statement}' already exists. No changes made.")
         return
     
@@ -2676,8 +2907,7 @@ def insert_header_include_in_cpp(file_path):
     
     modified_content = "\n".join(lines)
     
-    with open(file_path, 'w') as file:
-        file.write(modified_content)
+    write_file(file_path, modified_content)
     
     logging.info(f"\tInserted '{include_statement}' at line {insert_index + 1}")
     logging.info(f"\tFile {os.path.basename(file_path)} has been successfully modified.")
@@ -2689,11 +2919,11 @@ def preserve_original_headers():
     logging.info("Processing: preserve_original_headers() ..")
 
     original_headers = {}
-    for file in os.listdir(glob_pio_include):
-        if file.endswith('.h'):
-            header_path = os.path.join(glob_pio_include, file)
-            with open(header_path, 'r') as f:
-                original_headers[file] = f.read()
+    with os.scandir(glob_pio_include) as entries:
+        for entry in entries:
+            if entry.name.endswith('.h') and entry.is_file():
+                with open(entry.path, 'r') as f:
+                    original_headers[entry.name] = f.read()
 
     return original_headers
 
@@ -2707,21 +2937,26 @@ def update_project_header(glob_pio_include, glob_project_name, original_content)
     project_header_path = os.path.join(glob_pio_include, f"{glob_project_name}.h")
 
     # Split the original content into sections
-    sections = re.split(r'(//==.*?==)', original_content, flags=re.DOTALL)
+    sections = section_marker_re.split(original_content)
 
     new_content = []
     local_includes = []
 
+    # List the headers once, not for every includes section, and leave out the ones
+    # that are already included (collected in one pass over the original content)
+    project_header = f"{glob_project_name}.h"
+    existing_includes = set(quoted_include_line_re.findall(original_content))
+    with os.scandir(glob_pio_include) as entries:
+        header_include_lines = [f'#include "{entry.name}"\n' for entry in entries
+                                if entry.name.endswith('.h') and entry.name != project_header
+                                and entry.name not in existing_includes]
+
     # Process each section
     for i, section in enumerate(sections):
-        if section.strip() == f"{all_includes_marker}":
+        if section.strip() == all_includes_marker:
             # Add new local includes here
             new_content.append(section + "\n")
-            for file in os.listdir(glob_pio_include):
-                if file.endswith('.h') and file != f"{glob_project_name}.h":
-                    include_line = f'#include "{file}"\n'
-                    if include_line not in original_content:
-                        new_content.append(include_line)
+            new_content.extend(header_include_lines)
             new_content.append("\n")
         elif i == 0:  # First section (before any //== markers)
             new_content.append(section)
@@ -2733,9 +2968,8 @@ def update_project_header(glob_pio_include, glob_project_name, original_content)
         else:
             new_content.append(section)
 
-    # Write the updated content back to the file
-    with open(project_header_path, 'w') as f:
-        f.writelines(new_content)
+    # Write the updated content back to the file with a single write
+    write_file(project_header_path, ''.join(new_content))
 
     logging.info(f"\tUpdated project header {glob_project_name}.h while preserving original content")
 
@@ -2744,7 +2978,7 @@ def update_project_header(glob_pio_include, glob_project_name, original_content)
 #------------------------------------------------------------------------------------------------------
 def main():
     global glob_ino_project_folder, glob_project_name, glob_pio_folder, glob_pio_src, glob_pio_include
-    global args
+    global args, deferred_write_paths
 
     args = parse_arguments()
     setup_logging(args.debug)
@@ -2789,8 +3023,7 @@ def main():
         copy_data_folder()
         create_platformio_ini()
         create_arduinoglue_file()
-        extract_and_comment_defines()
-        move_struct_union_and_enum_declarations()
+        extract_defines_and_move_declarations()
 
 
         search_folders = [glob_pio_src, glob_pio_include]
@@ -2803,35 +3036,42 @@ def main():
         logging.info("         prototypes.. and insert Header Guards in all existing header files")
         logging.info("=======================================================================================================")
 
-        for folder in search_folders:
-            for root, _, files in os.walk(folder):
-                for file in files:
-                    if file.endswith(('.h', '.ino')):
-                        file_path = os.path.join(root, file)
-                        base_name = os.path.basename(file)  # Get the basename without extension
-                        logging.info("")
-                        logging.debug("-------------------------------------------------------------------------------------------------------")
-                        logging.debug(f"Processing file: {short_path(file_path)} basename: [{base_name}]")
-
-                        lib_includes = extract_all_includes_from_file(file_path)
-                        if args.debug:
-                          print_includes(lib_includes)
-                        dict_all_includes.update({include: None for include in lib_includes})
-                        global_vars = extract_global_variables(file_path)
-                        if args.debug:
-                            print_global_vars(global_vars)
-                        dict_global_variables.update(global_vars)
-                        global_vars = extract_constant_pointers(file_path)
-                        if args.debug:
-                            print_global_vars(global_vars)
-                        dict_global_variables.update(global_vars)
-                        prototypes = extract_prototypes(file_path)
-                        if args.debug:
-                            print_prototypes(prototypes)
-                        dict_prototypes.update(prototypes)
-
-                        if file.endswith('.h') and file != "arduinoGlue.h":
-                            add_guards_and_marker_to_header(file_path)
+        file_paths = [file_path for folder in search_folders for file_path in walk_files(folder, ('.h', '.ino'))]
+
+        # All steps work on the cached contents, so a file is only written once (after its last step)
+        deferred_write_paths = set()
+        for file_path in file_paths:
+            file_name = os.path.basename(file_path)
+            logging.info("")
+            logging.debug("-------------------------------------------------------------------------------------------------------")
+            logging.debug(f"Processing file: {short_path(file_path)} basename: [{file_name}]")
+
+            try:
+                lib_includes = extract_all_includes_from_file(file_path)
+                if args.debug:
+                    print_includes(lib_includes)
+                dict_all_includes.update({include: None for include in lib_includes})
+                global_vars = extract_global_variables(file_path)
+                if args.debug:
+                    print_global_vars(global_vars)
+                dict_global_variables.update(global_vars)
+                global_vars = extract_constant_pointers(file_path)
+                if args.debug:
+                    print_global_vars(global_vars)
+                dict_global_variables.update(global_vars)
+                prototypes = extract_prototypes(file_path)
+                if args.debug:
+                    print_prototypes(prototypes)
+                dict_prototypes.update(prototypes)
+
+                if file_name.endswith('.h') and file_name != "arduinoGlue.h":
+                    add_guards_and_marker_to_header(file_path)
+            finally:
+                flush_deferred_writes()
+        deferred_write_paths = None
+
+        # Later steps modify the files without going through the cache
+        dict_file_contents.clear()
 
         logging.info("")
         logging.info("And now the complete list of #includes:")
@@ -2842,21 +3082,20 @@ def main():
         print_prototypes(dict_prototypes)
 
         logging.info("And now add all dict's to arduinoGlue.h:")
-        update_arduinoglue_with_includes(dict_all_includes)
-        update_arduinoglue_with_global_variables(dict_global_variables)
-        update_arduinoglue_with_prototypes(dict_prototypes)
+        update_arduinoglue(dict_all_includes, dict_global_variables, dict_prototypes)
 
         logging.info("")
         logging.info("=======================================================================================================")
         logging.info(f"[Step 4] Create new header files for all '.ino' files")
         logging.info("=======================================================================================================")
 
-        for filename in os.listdir(glob_pio_src):
+        # Steps 4 to 6 don't add or remove files in glob_pio_src, so its listing is also used for Step 6
+        src_files = os.listdir(glob_pio_src)
+        for filename in src_files:
             logging.debug(f"Processing file: {os.path.basename(filename)}")
-            ino_name    = os.path.basename(filename)
-            base_name   = os.path.splitext(ino_name)[0]  # Get the basename without extension
-            header_name = ino_name.replace(".ino", ".h")
             if filename.endswith(".ino"):
+                ino_name    = os.path.basename(filename)
+                header_name = ino_name.replace(".ino", ".h")
                 create_new_header_file(ino_name, header_name)
 
         logging.info("")
@@ -2872,12 +3111,10 @@ def main():
         logging.info(f"[Step 6] rename all '.ino' files to '.cpp'")
         logging.info("=======================================================================================================")
 
-        for filename in os.listdir(glob_pio_src):
+        for filename in src_files:
             logging.debug(f"Found file: {os.path.basename(filename)}")
-            ino_name = os.path.basename(filename)
-            base_name = os.path.splitext(ino_name)[0]  # Get the basename without extension
-            header_name = ino_name.replace(".ino", ".h")
             if filename.endswith(".ino"):
+                ino_name = os.path.basename(filename)
                 ino_path = os.path.join(glob_pio_src, filename)
                 cpp_name = ino_name.replace(".ino", ".cpp")
                 cpp_path = os.path.join(glob_pio_src, cpp_name)